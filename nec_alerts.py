@@ -0,0 +1,322 @@
+"""
+NEC手术风险预测 - 事件驱动重新评分与风险等级提醒
+以文件投递目录模拟LIS检验结果推送：新检验事件到达后，只对受影响的患者异步批量重新评分，
+风险等级（get_risk_category 的三档）发生变化时推送提醒给订阅者
+
+检验事件为JSON对象（.json 文件或 .jsonl 每行一个）：
+    {"patient_id": "P001", "site_id": "default", "hco3_24h": 16.0, "plt_24h": 85}
+尚未报告（或值为 null）的指标按缺失值（NaN）评分，提醒中列出依赖的缺失指标。
+已报告的特征少于 MIN_REPORTED_FEATURES 个时不记录风险等级，避免几乎全靠缺失值分支的初始分层；
+等级变化若与新报告的指标同时出现，提醒中列出这些指标（newly_reported），区分缺失值补齐引起的变化
+
+运行：
+    python nec_alerts.py --watch lis_drop/ --alerts alerts.jsonl
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import os
+import time
+
+import pandas as pd
+
+from nec_inference import FEATURE_COLS, missing_features, predict_with_missing
+from nec_model_manager import DEFAULT_SITE, ModelManager
+from nec_rules import risk_tier_codes
+from nec_thresholds import THRESHOLDS_FILE, load_thresholds
+
+ALERTS_FILE = 'alerts.jsonl'
+TIER_NAMES = ["低风险", "中风险", "高风险"]
+
+# 记录首个风险等级前至少需要报告的特征数（共10个）
+MIN_REPORTED_FEATURES = 5
+
+
+def validate_event_values(state, bundle):
+    """检查患者的检验值能否编码（分类变量为已知类别、其余为数值），返回错误说明，合法时返回 None"""
+    for col in bundle.feature_cols:
+        value = state.get(col)
+        if value is None:
+            continue
+        encoder = bundle.label_encoders.get(col)
+        if encoder is not None and isinstance(value, str):
+            if value not in encoder.classes_:
+                return f"{col} 为未知类别 {value!r}"
+            continue
+        try:
+            float(value)
+        except (TypeError, ValueError):
+            return f"{col} 不是数值 {value!r}"
+    return None
+
+
+def validate_event(event):
+    """检查事件结构（JSON对象且带非空的 patient_id），返回错误说明，合法时返回 None"""
+    if not isinstance(event, dict):
+        return "不是JSON对象"
+    patient_id = event.get('patient_id')
+    if not isinstance(patient_id, (str, int)) or isinstance(patient_id, bool) or patient_id == '':
+        return "缺少 patient_id"
+    if not isinstance(event.get('site_id', DEFAULT_SITE), str):
+        return "site_id 不是字符串"
+    return None
+
+
+class RescoringService:
+    """
+    增量重新评分服务
+
+    事件只更新患者的最新检验值并标记为待评分；每个去抖窗口结束时，
+    将窗口内所有待评分患者按院区合并为一次批量预测，突发事件因此被合并。
+    """
+
+    def __init__(self, manager, debounce=0.5):
+        self.manager = manager
+        self.debounce = debounce
+        self.patients = {}      # patient_id -> {'site_id': ..., 特征: 值}
+        self.tiers = {}         # patient_id -> 最近一次风险分层代码
+        self.probs = {}
+        self.missing = {}       # patient_id -> 最近一次评分时的缺失特征列表
+        self.n_events = 0
+        self.n_scored = 0
+        self.n_failed = 0
+        self._thresholds = {}
+        self._dirty = set()
+        self._subscribers = []
+        self._events = asyncio.Queue()
+
+    async def submit(self, event):
+        """提交一条检验事件"""
+        await self._events.put(event)
+
+    def subscribe(self, patient_ids=None, maxsize=1000):
+        """订阅提醒，patient_ids 为 None 时接收全部患者；返回 asyncio.Queue"""
+        queue = asyncio.Queue(maxsize=maxsize)
+        self._subscribers.append((queue, None if patient_ids is None else set(patient_ids)))
+        return queue
+
+    def thresholds(self, site_id):
+        """院区的分层阈值（首次使用时读取 thresholds.json）"""
+        if site_id not in self._thresholds:
+            path = self.manager.artifact_path(site_id, THRESHOLDS_FILE)
+            self._thresholds[site_id] = load_thresholds(path)
+        return self._thresholds[site_id]
+
+    def _publish(self, alert):
+        for queue, patient_ids in self._subscribers:
+            if patient_ids is None or alert['patient_id'] in patient_ids:
+                if not queue.full():
+                    queue.put_nowait(alert)
+
+    async def _ingest(self):
+        while True:
+            event = await self._events.get()
+            reason = validate_event(event)
+            if reason:
+                print(f"无效检验事件，已跳过（{reason}）: {event!r:.200}")
+                continue
+            event = dict(event)
+            patient_id = event.pop('patient_id')
+            state = self.patients.setdefault(patient_id, {'site_id': DEFAULT_SITE})
+            state.update(event)
+            self._dirty.add(patient_id)
+            self.n_events += 1
+
+    def _score(self, patient_ids):
+        """
+        批量评分（在线程池中执行），未报告的检验值作为缺失值由模型的缺失值分支处理
+
+        返回 ({患者: (概率, 缺失特征列表)}, 失败患者及原因)：未知院区只影响该院区的患者，
+        非法取值只影响对应患者，其余患者照常评分。
+        """
+        results = {}
+        failed = {}
+        by_site = {}
+        for patient_id in patient_ids:
+            state = self.patients[patient_id]
+            by_site.setdefault(state['site_id'], []).append(patient_id)
+        for site_id, ids in by_site.items():
+            try:
+                bundle = self.manager.get(site_id)
+            except Exception as e:
+                failed.update((p, f"院区 {site_id} 不可用: {e}") for p in ids)
+                continue
+            valid = []
+            for p in ids:
+                reason = validate_event_values(self.patients[p], bundle)
+                if reason:
+                    failed[p] = reason
+                else:
+                    valid.append(p)
+            if not valid:
+                continue
+            try:
+                results.update(self._predict(bundle, valid))
+            except Exception:
+                # 校验未覆盖的错误：逐个患者重试，只丢弃出错的患者
+                for p in valid:
+                    try:
+                        results.update(self._predict(bundle, [p]))
+                    except Exception as e:
+                        failed[p] = str(e)
+        return results, failed
+
+    def _predict(self, bundle, patient_ids):
+        """一次批量预测，返回 {患者: (概率, 缺失特征列表)}"""
+        df = pd.DataFrame([self.patients[p] for p in patient_ids])
+        probs, masks = predict_with_missing(bundle.model, bundle.scaler, bundle.label_encoders,
+                                            bundle.feature_cols, df)
+        return {p: (float(prob), missing_features(mask, bundle.feature_cols))
+                for p, prob, mask in zip(patient_ids, probs, masks)}
+
+    async def _flush(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.debounce)
+            if not self._dirty:
+                continue
+            batch, self._dirty = self._dirty, set()
+            try:
+                results, failed = await loop.run_in_executor(None, self._score, batch)
+            except Exception as e:
+                # 意外错误：整批放回待评分集合，下个窗口重试，不丢失等级变化
+                print(f"评分失败，{len(batch)} 位患者重新排队: {e}")
+                self._dirty |= batch
+                continue
+            for patient_id, reason in failed.items():
+                print(f"患者 {patient_id} 评分失败，已跳过: {reason}")
+            self.n_failed += len(failed)
+            if not results:
+                continue
+            for patient_id, (prob, missing) in results.items():
+                site_id = self.patients[patient_id]['site_id']
+                old = self.tiers.get(patient_id)
+                if old is None and len(FEATURE_COLS) - len(missing) < MIN_REPORTED_FEATURES:
+                    # 报告的指标太少：不建立基线等级，等更多检验结果到达
+                    continue
+                tier = int(risk_tier_codes([prob], self.thresholds(site_id))[0])
+                previous_missing = self.missing.get(patient_id, [])
+                self.tiers[patient_id] = tier
+                self.probs[patient_id] = prob
+                self.missing[patient_id] = missing
+                if old is not None and old != tier:
+                    self._publish({
+                        'patient_id': patient_id,
+                        'site_id': site_id,
+                        'old_tier': TIER_NAMES[old],
+                        'new_tier': TIER_NAMES[tier],
+                        'prob': prob,
+                        'missing': missing,
+                        'newly_reported': [col for col in previous_missing if col not in missing],
+                        'time': time.time(),
+                    })
+            self.n_scored += len(results)
+
+    async def run(self, *sources):
+        """运行服务及事件来源协程，直到被取消"""
+        await asyncio.gather(self._ingest(), self._flush(), *sources)
+
+
+def read_events(path, original_name):
+    """
+    读取一个事件文件，返回事件列表；.jsonl 逐行解析，无法解析的行记录后跳过
+
+    .json 文件整体无法解析时抛出 ValueError（由调用方移入 .bad）。
+    """
+    with open(path, encoding='utf-8') as f:
+        if not original_name.endswith('.jsonl'):
+            data = json.load(f)
+            return data if isinstance(data, list) else [data]
+        events = []
+        for n, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                events.append(json.loads(line))
+            except ValueError as e:
+                print(f"{original_name} 第 {n} 行无法解析，已跳过: {e}")
+        return events
+
+
+async def watch_drop_dir(service, path, poll=0.2):
+    """
+    监视投递目录，处理新的 .json/.jsonl 文件
+
+    投递方应先写入临时文件（如 .tmp 后缀）再原子重命名为 .json/.jsonl，避免读到写了一半的文件。
+    文件先重命名为 .processing 认领，读取完成后改为 .done；无法读取的文件改为 .bad 并记录，不影响后续文件。
+    """
+    while True:
+        files = sorted(glob.glob(os.path.join(path, '*.json')) + glob.glob(os.path.join(path, '*.jsonl')))
+        for file in files:
+            claimed = file + '.processing'
+            try:
+                os.replace(file, claimed)
+            except FileNotFoundError:
+                continue
+            try:
+                events = read_events(claimed, file)
+            except (OSError, ValueError) as e:
+                print(f"无法读取事件文件 {file}，已移至 .bad: {e}")
+                os.replace(claimed, file + '.bad')
+                continue
+            os.replace(claimed, file + '.done')
+            for event in events:
+                await service.submit(event)
+        await asyncio.sleep(poll)
+
+
+async def write_alerts(queue, path=ALERTS_FILE):
+    """将提醒追加写入JSONL文件（供Streamlit会话读取）"""
+    while True:
+        alert = await queue.get()
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(alert, ensure_ascii=False) + '\n')
+
+
+def read_alerts(patient_ids, path=ALERTS_FILE, limit=20, tail_bytes=1 << 18):
+    """读取指定患者最近的提醒（只读取文件末尾部分）"""
+    if not os.path.exists(path):
+        return []
+    patient_ids = set(patient_ids)
+    with open(path, 'rb') as f:
+        size = f.seek(0, os.SEEK_END)
+        f.seek(max(0, size - tail_bytes))
+        lines = f.read().decode('utf-8', errors='ignore').splitlines()
+    if size > tail_bytes:
+        # 丢弃可能被截断的首行
+        lines = lines[1:]
+    alerts = []
+    for line in reversed(lines):
+        try:
+            alert = json.loads(line)
+        except ValueError:
+            continue
+        if alert['patient_id'] in patient_ids:
+            alerts.append(alert)
+            if len(alerts) >= limit:
+                break
+    return alerts
+
+
+def main():
+    parser = argparse.ArgumentParser(description="事件驱动重新评分与风险等级提醒")
+    parser.add_argument('--watch', required=True, help="LIS检验事件投递目录")
+    parser.add_argument('--alerts', default=ALERTS_FILE, help="提醒输出文件（JSONL）")
+    parser.add_argument('--debounce', type=float, default=0.5, help="去抖窗口（秒）")
+    args = parser.parse_args()
+
+    async def run():
+        service = RescoringService(ModelManager(), debounce=args.debounce)
+        alerts = service.subscribe()
+        await service.run(watch_drop_dir(service, args.watch), write_alerts(alerts, args.alerts))
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+"""
+NEC手术风险预测 - 持久化预测缓存
+SQLite（WAL模式）存储预测结果和解释，键为 缓存版本 + 模型包哈希 + 结果类型 + 规范化输入向量，
+进程重启后可直接复用；支持同一主机上的多进程并发读、按容量淘汰和启动时预热热点条目。
+WAL依赖同一主机的共享内存，缓存文件须放在本地磁盘，每个节点一份，不能放在网络文件系统上共享
+"""
+
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+
+CACHE_FILE = os.environ.get('NEC_CACHE_PATH', 'nec_cache.sqlite')
+
+# 缓存格式/结果代码版本，计入键中：特征编码、反事实搜索（可干预指标范围、网格步数、算法）
+# 等产生缓存值的代码变化时递增，升级后旧条目自然失效并按容量淘汰
+CACHE_VERSION = 2
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS cache (
+    key TEXT PRIMARY KEY,
+    kind TEXT NOT NULL,
+    value TEXT NOT NULL,
+    hits INTEGER NOT NULL DEFAULT 0,
+    last_access REAL NOT NULL
+)
+"""
+
+
+def canonical_key(kind, bundle_hash, input_data):
+    """规范化输入（按特征名排序、数值统一为6位有效数字）后连同缓存版本取SHA-256"""
+    items = []
+    for name in sorted(input_data):
+        value = input_data[name]
+        if isinstance(value, (int, float)) and not isinstance(value, bool):
+            value = float(f"{float(value):.6g}")
+        items.append([name, value])
+    payload = json.dumps([CACHE_VERSION, kind, bundle_hash, items], ensure_ascii=False, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class PredictionCache:
+    """
+    持久化键值缓存
+
+    每个线程使用独立的SQLite连接；值以JSON保存。
+    条目数超过 max_entries 时按最近访问时间淘汰最旧的10%。
+    """
+
+    def __init__(self, path=CACHE_FILE, max_entries=100000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        self._hot = {}
+        self._puts = 0
+        conn = self._conn()
+        conn.execute(SCHEMA)
+        conn.execute("CREATE INDEX IF NOT EXISTS idx_last_access ON cache(last_access)")
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def get(self, kind, bundle_hash, input_data):
+        """读取缓存，未命中返回 None"""
+        key = canonical_key(kind, bundle_hash, input_data)
+        if key in self._hot:
+            return self._hot[key]
+        conn = self._conn()
+        row = conn.execute("SELECT value FROM cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        try:
+            conn.execute("UPDATE cache SET hits = hits + 1, last_access = ? WHERE key = ?",
+                         (time.time(), key))
+            conn.commit()
+        except sqlite3.OperationalError:
+            # 写锁繁忙时跳过统计更新，不影响读取
+            pass
+        return json.loads(row[0])
+
+    def put(self, kind, bundle_hash, input_data, value):
+        """写入缓存（尽力而为：写锁繁忙时放弃本次写入，返回 False）"""
+        key = canonical_key(kind, bundle_hash, input_data)
+        conn = self._conn()
+        try:
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (key, kind, value, hits, last_access) "
+                "VALUES (?, ?, ?, COALESCE((SELECT hits FROM cache WHERE key = ?), 0), ?)",
+                (key, kind, json.dumps(value, ensure_ascii=False), key, time.time()),
+            )
+            conn.commit()
+            self._puts += 1
+            if self._puts % 100 == 0:
+                self.evict()
+        except sqlite3.OperationalError:
+            # 超时仍拿不到写锁（database is locked）时不影响已算出的结果
+            conn.rollback()
+            return False
+        return True
+
+    def evict(self):
+        """超出容量时淘汰最久未访问的条目"""
+        conn = self._conn()
+        (count,) = conn.execute("SELECT COUNT(*) FROM cache").fetchone()
+        if count <= self.max_entries:
+            return 0
+        n_delete = count - self.max_entries + self.max_entries // 10
+        conn.execute(
+            "DELETE FROM cache WHERE key IN "
+            "(SELECT key FROM cache ORDER BY last_access LIMIT ?)", (n_delete,)
+        )
+        conn.commit()
+        return n_delete
+
+    def warm_up(self, n=1000):
+        """将命中次数最多的 n 条载入内存"""
+        rows = self._conn().execute(
+            "SELECT key, value FROM cache ORDER BY hits DESC LIMIT ?", (n,)
+        ).fetchall()
+        self._hot = {key: json.loads(value) for key, value in rows}
+        return len(self._hot)
+
+    def __len__(self):
+        return self._conn().execute("SELECT COUNT(*) FROM cache").fetchone()[0]
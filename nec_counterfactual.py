@@ -0,0 +1,114 @@
+"""
+NEC手术风险预测 - 反事实"降级路径"搜索
+在可干预的实验室指标上生成受约束的候选输入，一次批量预测后
+返回使患者降到更低风险等级所需的最小改变
+"""
+
+import itertools
+import time
+
+import numpy as np
+import pandas as pd
+
+from nec_inference import encode_features
+
+# 可通过治疗干预的指标及其目标范围（新生儿参考值）
+MODIFIABLE_FEATURES = {
+    'hco3_24h': {'name': 'HCO₃', 'unit': 'mmol/L', 'range': (18.0, 28.0)},
+    'glucose_mmolL_24h': {'name': '血糖', 'unit': 'mmol/L', 'range': (3.9, 6.1)},
+    'hb_24h': {'name': '血红蛋白', 'unit': 'g/L', 'range': (110.0, 180.0)},
+    'plt_24h': {'name': '血小板', 'unit': '×10⁹/L', 'range': (100.0, 400.0)},
+}
+
+# 候选组合数上限：超过时缩小网格步数（一次predict_proba约在时间预算内完成）
+MAX_CANDIDATES = 20000
+
+
+def _candidate_values(current, value_range, n_steps):
+    """候选取值：当前值加上目标范围内的等距网格"""
+    lo, hi = value_range
+    grid = np.round(np.linspace(lo, hi, n_steps), 1)
+    return np.unique(np.concatenate([[current], grid]))
+
+
+def search_counterfactuals(model, scaler, label_encoders, feature_cols, input_data,
+                           target_prob, n_steps=9, top_k=5, time_budget_ms=200):
+    """
+    搜索使预测概率降到 target_prob 以下的最小改变组合
+
+    所有候选输入在一次 predict_proba 调用中完成评分。
+    返回按"改变指标数、标准化改变幅度"排序的建议列表；
+    每种指标组合只保留改变最小的一条，并跳过包含已有建议的组合。
+    未检测（缺失）的指标当前值未知，不参与搜索。
+    网格大小只受 MAX_CANDIDATES 限制，time_budget_ms 仅用于在结果中报告是否超时（within_budget）。
+    """
+    start = time.perf_counter()
+
+    base = pd.DataFrame([input_data])
+    base_scaled = encode_features(base, scaler, label_encoders, feature_cols)[0]
+
+    cols = [c for c in MODIFIABLE_FEATURES if c in feature_cols and not pd.isna(input_data.get(c))]
+    if not cols:
+        return {'suggestions': [], 'n_candidates': 0,
+                'elapsed_ms': (time.perf_counter() - start) * 1000, 'within_budget': True}
+    idx = np.array([feature_cols.index(c) for c in cols])
+    current = np.array([float(input_data[c]) for c in cols])
+
+    # 候选组合数超过上限时缩小网格
+    while True:
+        grids = [_candidate_values(current[i], MODIFIABLE_FEATURES[c]['range'], n_steps)
+                 for i, c in enumerate(cols)]
+        n_candidates = int(np.prod([len(g) for g in grids]))
+        if n_candidates <= MAX_CANDIDATES or n_steps <= 3:
+            break
+        n_steps -= 1
+
+    # 候选矩阵（原始单位）：笛卡尔积
+    raw = np.array(list(itertools.product(*grids)), dtype=np.float64)
+
+    # 直接在标准化空间中替换可干预列，避免逐行编码
+    X = np.repeat(base_scaled[np.newaxis, :], len(raw), axis=0)
+    X[:, idx] = (raw - scaler.mean_[idx]) / scaler.scale_[idx]
+    probs = model.predict_proba(X)[:, 1]
+
+    changed = ~np.isclose(raw, current)
+    n_changed = changed.sum(axis=1)
+    distance = (np.abs(raw - current) / scaler.scale_[idx]).sum(axis=1)
+
+    hits = np.flatnonzero((probs < target_prob) & (n_changed > 0))
+    order = hits[np.lexsort((distance[hits], n_changed[hits]))]
+
+    suggestions = []
+    selected = []
+    for row in order:
+        # 已有建议的指标组合是其子集时，该候选不是最小改变
+        if any(np.all(mask <= changed[row]) for mask in selected):
+            continue
+        selected.append(changed[row])
+        suggestions.append({
+            'changes': {
+                cols[j]: (float(current[j]), float(raw[row, j]))
+                for j in np.flatnonzero(changed[row])
+            },
+            'prob': float(probs[row]),
+            'distance': float(distance[row]),
+        })
+        if len(suggestions) >= top_k:
+            break
+
+    elapsed_ms = (time.perf_counter() - start) * 1000
+    return {
+        'suggestions': suggestions,
+        'n_candidates': len(raw),
+        'elapsed_ms': elapsed_ms,
+        'within_budget': elapsed_ms <= time_budget_ms,
+    }
+
+
+def format_suggestion(suggestion):
+    """将一条建议格式化为可读文本"""
+    parts = []
+    for col, (old, new) in suggestion['changes'].items():
+        info = MODIFIABLE_FEATURES[col]
+        parts.append(f"{info['name']} {old:.1f} → {new:.1f} {info['unit']}")
+    return "，".join(parts) + f"（预测概率 {suggestion['prob']*100:.1f}%）"
@@ -0,0 +1,197 @@
+"""
+NEC手术风险预测 - 批量结果的Arrow/Parquet输出
+批量评分结果按列写为 Apache Arrow IPC（流或文件格式）或 Parquet，供数据仓库和BI工具直接读取。
+数值列直接引用评分输出的NumPy缓冲区构造Arrow数组，不经过pandas对象列或CSV；
+IPC输出可通过内存映射零拷贝读回，用于重新分析历史评分批次
+
+示例：
+    python nec_export.py census.csv --site site_a --out results.arrow
+    python nec_export.py --read results.arrow
+"""
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from nec_inference import RESULT_DTYPE, score_columns
+from nec_rules import ADVICE_RULES, WARNING_RULES
+
+# 扩展名 -> 输出格式（stream: IPC流，file: IPC文件，parquet）
+FORMATS = {
+    '.arrows': 'stream',
+    '.arrow': 'file',
+    '.feather': 'file',
+    '.parquet': 'parquet',
+}
+
+
+def output_format(path, fmt=None):
+    """确定输出格式：显式指定优先，否则按扩展名推断"""
+    if fmt is None:
+        fmt = FORMATS.get(os.path.splitext(path)[1].lower())
+    if fmt not in ('stream', 'file', 'parquet'):
+        raise ValueError(f"无法确定输出格式：{path}（支持 {', '.join(FORMATS)}）")
+    return fmt
+
+
+def results_metadata(bundle, thresholds=None):
+    """Schema元数据：院区、特征顺序（解码缺失位掩码）和规则消息（解码建议/警示位集）"""
+    return {
+        'site_id': bundle.site_id,
+        'model_version': bundle.bundle_hash,
+        'feature_cols': json.dumps(list(bundle.feature_cols)),
+        'advice_rules': json.dumps([message for *_, message in ADVICE_RULES], ensure_ascii=False),
+        'warning_rules': json.dumps([message for *_, message in WARNING_RULES], ensure_ascii=False),
+        'thresholds': json.dumps(list(thresholds) if thresholds else None),
+        'scored_at': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def results_batch(columns, model_version, patient_ids=None):
+    """
+    评分列 -> pyarrow.RecordBatch
+
+    columns 为 score_columns 的输出（各列为连续的NumPy数组），数值列零拷贝引用其缓冲区；
+    模型版本为字典编码列，每行只占一个int8索引。
+    """
+    import pyarrow as pa
+
+    n_rows = len(columns['prob'])
+    arrays, names = [], []
+    if patient_ids is not None:
+        # 患者ID统一为字符串列，各块的schema与ID的推断类型无关
+        arrays.append(pa.Array.from_pandas(patient_ids.astype('string'), type=pa.string()))
+        names.append('patient_id')
+    for name in RESULT_DTYPE.names:
+        arrays.append(pa.array(columns[name]))
+        names.append(name)
+    arrays.append(pa.DictionaryArray.from_arrays(np.zeros(n_rows, dtype=np.int8), pa.array([model_version])))
+    names.append('model_version')
+    return pa.RecordBatch.from_arrays(arrays, names=names)
+
+
+def score_to_batches(census_chunks, bundle, thresholds=None):
+    """逐块批量评分，每块产出一个RecordBatch"""
+    for census in census_chunks:
+        if census.empty:
+            continue
+        columns = score_columns(bundle.model, bundle.scaler, bundle.label_encoders, bundle.feature_cols,
+                                census, thresholds)
+        patient_ids = census['patient_id'] if 'patient_id' in census else None
+        yield results_batch(columns, bundle.bundle_hash, patient_ids)
+
+
+def write_results(batches, path, fmt=None, metadata=None):
+    """
+    将RecordBatch序列流式写入文件（内存中只保留当前块），返回写出的行数
+
+    先写入同目录的临时文件，全部写完后再原子替换为目标文件；中途出错时不留下不完整的输出。
+    """
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+
+    fmt = output_format(path, fmt)
+    tmp_path = path + '.tmp'
+    writer = None
+    n_rows = 0
+    try:
+        for batch in batches:
+            if writer is None:
+                schema = batch.schema.with_metadata(metadata or {})
+                if fmt == 'stream':
+                    writer = ipc.new_stream(tmp_path, schema)
+                elif fmt == 'file':
+                    writer = ipc.new_file(tmp_path, schema)
+                else:
+                    writer = pq.ParquetWriter(tmp_path, schema, compression='zstd')
+            writer.write_batch(batch)
+            n_rows += batch.num_rows
+        if writer is None:
+            raise ValueError("没有可写出的评分结果")
+        writer.close()
+        os.replace(tmp_path, path)
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(tmp_path)
+        raise
+    return n_rows
+
+
+def read_results(path, fmt=None):
+    """
+    读取评分结果为 pyarrow.Table
+
+    IPC流/文件通过内存映射打开，列直接引用映射页面（零拷贝，按需从磁盘读入）；
+    Parquet为压缩列存储，按列解码。
+    """
+    import pyarrow as pa
+    import pyarrow.ipc as ipc
+    import pyarrow.parquet as pq
+
+    fmt = output_format(path, fmt)
+    if fmt == 'parquet':
+        return pq.read_table(path, memory_map=True)
+    source = pa.memory_map(path)
+    reader = ipc.open_stream(source) if fmt == 'stream' else ipc.open_file(source)
+    return reader.read_all()
+
+
+def results_array(table):
+    """Table -> RESULT_DTYPE 结构化数组，可配合 PredictionRecord.from_row 和规则表渲染消息"""
+    results = np.empty(table.num_rows, dtype=RESULT_DTYPE)
+    for name in RESULT_DTYPE.names:
+        results[name] = table.column(name).to_numpy()
+    return results
+
+
+def summarize_results(table):
+    """按模型版本和风险分层汇总人数与平均概率"""
+    summary = table.group_by(['model_version', 'tier']).aggregate([('prob', 'count'), ('prob', 'mean')])
+    return summary.to_pandas().sort_values(['model_version', 'tier']).reset_index(drop=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量评分结果输出为Arrow IPC/Parquet")
+    parser.add_argument('census', nargs='?', help="患者清单CSV（可选 patient_id + 全部特征列）")
+    parser.add_argument('--site', default='default', help="院区ID")
+    parser.add_argument('--out', default='results.arrow',
+                        help="输出路径，按扩展名选择格式：.arrows 流 / .arrow 文件 / .parquet")
+    parser.add_argument('--format', choices=['stream', 'file', 'parquet'], default=None,
+                        help="显式指定输出格式")
+    parser.add_argument('--chunk-size', type=int, default=100_000, help="每块评分的行数")
+    parser.add_argument('--read', default=None, help="读取已有的输出文件并打印汇总")
+    args = parser.parse_args()
+
+    if args.read:
+        start = time.perf_counter()
+        table = read_results(args.read, args.format)
+        metadata = {k.decode(): v.decode() for k, v in (table.schema.metadata or {}).items()}
+        print(f"{args.read}: {table.num_rows} 行，院区 {metadata.get('site_id', '-')}，"
+              f"评分时间 {metadata.get('scored_at', '-')}（读取 {time.perf_counter() - start:.3f} 秒）")
+        print(summarize_results(table).to_string(index=False))
+        return
+
+    if not args.census:
+        parser.error("需要患者清单CSV或 --read")
+
+    from nec_model_manager import ModelManager
+    from nec_thresholds import THRESHOLDS_FILE, load_thresholds
+
+    start = time.perf_counter()
+    manager = ModelManager()
+    bundle = manager.get(args.site)
+    thresholds = load_thresholds(manager.artifact_path(args.site, THRESHOLDS_FILE))
+    chunks = pd.read_csv(args.census, chunksize=args.chunk_size, dtype={'patient_id': str})
+    n_rows = write_results(score_to_batches(chunks, bundle, thresholds), args.out, args.format,
+                           results_metadata(bundle, thresholds))
+    print(f"已输出 {n_rows} 条评分结果 -> {args.out}（{output_format(args.out, args.format)}，"
+          f"用时 {time.perf_counter() - start:.1f} 秒）")
+
+
+if __name__ == "__main__":
+    main()
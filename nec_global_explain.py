@@ -0,0 +1,187 @@
+"""
+NEC手术风险预测 - 全队列模型解释（离线预计算）
+对整个队列分块计算TreeSHAP，汇总为紧凑数组保存到模型包目录（global_explanations.npz）：
+特征重要性排序、CRP/IL-6/HCO3的分箱依赖曲线，以及各特征与出生体重分类（bw_cat）的交互效应。
+管理页（nec_model_dashboard.py）只读取汇总数组，访问时不重新计算解释
+
+示例：
+    python nec_global_explain.py cohort.csv --site site_a --bins 20
+"""
+
+import argparse
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from nec_inference import encode_features
+
+EXPLANATIONS_FILE = 'global_explanations.npz'
+
+# 绘制依赖曲线的特征和交互分组特征
+DEPENDENCE_FEATURES = ('crp_mgL_24h', 'il6_pgml_24h', 'hco3_24h')
+INTERACTION_FEATURE = 'bw_cat'
+
+# 每块行数：SHAP交互值每行占 (特征数+1)² 个float32
+CHUNK_ROWS = 20_000
+
+
+def _group_codes(values, encoder):
+    """分类变量 -> 编码器类别索引，缺失值归入最后一组"""
+    codes = np.full(len(values), len(encoder.classes_), dtype=np.int64)
+    present = values.notna().to_numpy()
+    if values.dtype == object:
+        codes[present] = encoder.transform(values[present])
+    else:
+        codes[present] = values[present].astype(np.int64)
+    return codes
+
+
+def _bin_codes(values, edges):
+    """按分位数边界分箱，缺失值归入最后一箱（第 len(edges)-1 箱）"""
+    codes = np.clip(np.searchsorted(edges, values, side='right') - 1, 0, len(edges) - 2)
+    codes[np.isnan(values)] = len(edges) - 1
+    return codes
+
+
+def compute_global_explanations(cohort, bundle, n_bins=20, interaction_rows=20_000, seed=0):
+    """
+    计算全队列解释汇总，返回 {名称: 数组} 字典（可直接 np.savez 保存）
+
+    SHAP值（logit尺度）对全部行计算；与 bw_cat 的SHAP交互值计算代价约为SHAP值的20倍，
+    默认只在随机抽取的 interaction_rows 行上计算（0 表示全部行）。
+    依赖曲线按原始单位的分位数分箱，每箱只保存计数、均值和平方和，缺失值单独一箱。
+    """
+    import xgboost as xgb
+
+    feature_cols = list(bundle.feature_cols)
+    booster = bundle.model.get_booster()
+    raw = cohort.reindex(columns=feature_cols)
+    n_rows, n_features = len(raw), len(feature_cols)
+    dep_idx = [feature_cols.index(f) for f in DEPENDENCE_FEATURES]
+    group_idx = feature_cols.index(INTERACTION_FEATURE)
+    encoder = bundle.label_encoders[INTERACTION_FEATURE]
+    n_groups = len(encoder.classes_) + 1
+    n_slots = n_bins + 1
+
+    quantiles = np.linspace(0, 1, n_bins + 1)
+    edges = np.stack([np.nanquantile(raw[f].to_numpy(dtype=np.float64), quantiles) for f in DEPENDENCE_FEATURES])
+    bins = np.stack([_bin_codes(raw[f].to_numpy(dtype=np.float64), edges[d])
+                     for d, f in enumerate(DEPENDENCE_FEATURES)])
+    groups = _group_codes(raw[INTERACTION_FEATURE], encoder)
+
+    rng = np.random.default_rng(seed)
+    with_interactions = np.zeros(n_rows, dtype=bool)
+    if interaction_rows and interaction_rows < n_rows:
+        with_interactions[rng.choice(n_rows, interaction_rows, replace=False)] = True
+    else:
+        with_interactions[:] = True
+
+    abs_sum = np.zeros(n_features)
+    shap_sum = np.zeros(n_features)
+    dep_count = np.zeros((len(dep_idx), n_slots))
+    dep_sum = np.zeros((len(dep_idx), n_slots))
+    dep_sq = np.zeros((len(dep_idx), n_slots))
+    inter_abs_sum = np.zeros(n_features)
+    inter_count = np.zeros((len(dep_idx), n_groups * n_slots))
+    inter_sum = np.zeros((len(dep_idx), n_groups * n_slots))
+
+    for start in range(0, n_rows, CHUNK_ROWS):
+        rows = slice(start, start + CHUNK_ROWS)
+        X = encode_features(cohort.iloc[rows], bundle.scaler, bundle.label_encoders, feature_cols)
+        shap = booster.predict(xgb.DMatrix(X, feature_names=feature_cols), pred_contribs=True)[:, :-1]
+        abs_sum += np.abs(shap).sum(axis=0)
+        shap_sum += shap.sum(axis=0)
+        for d, j in enumerate(dep_idx):
+            b = bins[d, rows]
+            dep_count[d] += np.bincount(b, minlength=n_slots)
+            dep_sum[d] += np.bincount(b, weights=shap[:, j], minlength=n_slots)
+            dep_sq[d] += np.bincount(b, weights=shap[:, j] ** 2, minlength=n_slots)
+
+        # 交互值只在抽样行上计算：φ(j, bw) 为对称矩阵的一半，交互效应合计为两倍
+        sampled = np.flatnonzero(with_interactions[rows])
+        if len(sampled):
+            dmatrix = xgb.DMatrix(X[sampled], feature_names=feature_cols)
+            inter = booster.predict(dmatrix, pred_interactions=True)[:, :-1, group_idx] * 2
+            inter[:, group_idx] = 0
+            inter_abs_sum += np.abs(inter).sum(axis=0)
+            g = groups[rows][sampled] * n_slots
+            for d, j in enumerate(dep_idx):
+                slot = g + bins[d, rows][sampled]
+                inter_count[d] += np.bincount(slot, minlength=n_groups * n_slots)
+                inter_sum[d] += np.bincount(slot, weights=inter[:, j], minlength=n_groups * n_slots)
+
+    mean_abs = abs_sum / max(n_rows, 1)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        dep_mean = dep_sum / dep_count
+        dep_std = np.sqrt(np.maximum(dep_sq / dep_count - dep_mean ** 2, 0))
+        inter_mean = inter_sum / inter_count
+    n_sampled = int(with_interactions.sum())
+
+    return {
+        'feature_cols': np.array(feature_cols),
+        'importance': mean_abs.astype(np.float32),
+        'mean_shap': (shap_sum / max(n_rows, 1)).astype(np.float32),
+        'importance_rank': np.argsort(-mean_abs).astype(np.int8),
+        'dependence_features': np.array(DEPENDENCE_FEATURES),
+        'bin_edges': edges.astype(np.float32),
+        'bin_count': dep_count.astype(np.int32),
+        'bin_mean_shap': dep_mean.astype(np.float32),
+        'bin_std_shap': dep_std.astype(np.float32),
+        'interaction_groups': np.array(list(encoder.classes_) + ['missing']),
+        'interaction_strength': (inter_abs_sum / max(n_sampled, 1)).astype(np.float32),
+        'interaction_count': inter_count.reshape(len(dep_idx), n_groups, n_slots).astype(np.int32),
+        'interaction_mean': inter_mean.reshape(len(dep_idx), n_groups, n_slots).astype(np.float32),
+        'n_rows': np.int64(n_rows),
+        'n_interaction_rows': np.int64(n_sampled),
+        'model_version': np.array(bundle.bundle_hash),
+        'computed_at': np.array(time.strftime('%Y-%m-%d %H:%M')),
+    }
+
+
+def save_global_explanations(path, summary):
+    """保存为未压缩的npz（只含数值和定长字符串数组，读取无需pickle）"""
+    np.savez(path, **summary)
+
+
+def load_global_explanations(path=EXPLANATIONS_FILE):
+    """读取汇总数组，文件不存在时返回 None"""
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        return {name: data[name] for name in data.files}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全队列模型解释预计算")
+    parser.add_argument('cohort', help="队列CSV，需包含全部特征列（允许缺失值）")
+    parser.add_argument('--site', default='default', help="院区ID，结果保存到该院区的模型包目录")
+    parser.add_argument('--bins', type=int, default=20, help="依赖曲线的分位数分箱数")
+    parser.add_argument('--interaction-rows', type=int, default=20_000,
+                        help="计算bw_cat交互值的抽样行数，0表示全部行")
+    parser.add_argument('--out', default=None, help="输出路径，默认写入院区模型包目录")
+    args = parser.parse_args()
+
+    from nec_model_manager import ModelManager
+
+    start = time.perf_counter()
+    manager = ModelManager()
+    bundle = manager.get(args.site)
+    cohort = pd.read_csv(args.cohort)
+    summary = compute_global_explanations(cohort, bundle, args.bins, args.interaction_rows)
+
+    out = args.out or os.path.join(manager.site_dir(args.site), EXPLANATIONS_FILE)
+    save_global_explanations(out, summary)
+
+    names = summary['feature_cols']
+    print("特征重要性（平均|SHAP|，logit尺度）：")
+    for rank, j in enumerate(summary['importance_rank'], 1):
+        print(f"  {rank:2d}. {names[j]:<20s} {summary['importance'][j]:.3f}"
+              f"  与bw_cat交互 {summary['interaction_strength'][j]:.3f}")
+    print(f"已汇总 {len(cohort)} 例患者（交互值 {summary['n_interaction_rows']} 例）-> {out}"
+          f"（{os.path.getsize(out) / 1024:.1f} KB，用时 {time.perf_counter() - start:.1f} 秒）")
+
+
+if __name__ == "__main__":
+    main()
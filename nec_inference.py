@@ -0,0 +1,119 @@
+"""
+NEC手术风险预测 - 批量推理工具
+Streamlit应用与离线脚本共用的特征编码和批量预测函数
+
+缺失值不做插补：NaN 原样通过编码和标准化，由XGBoost按训练时学到的默认分支处理；
+每行的缺失情况记为位掩码，用于标记依赖缺失值的预测
+"""
+
+import numpy as np
+
+from nec_rules import (ADVICE_RULES, DEFAULT_RISK_THRESHOLDS, WARNING_RULES, evaluate_rules,
+                       risk_tier_codes)
+
+
+# 规范特征顺序（与 feature_cols.pkl 一致）：模型不可用时（评分卡回退）缺失位掩码也按此顺序编码
+FEATURE_COLS = [
+    'crp_mgL_24h', 'il6_pgml_24h', 'hco3_24h', 'creatinine_24h', 'fibrinogen_gL_24h',
+    'glucose_mmolL_24h', 'xray_fixed_loops', 'bw_cat', 'hb_24h', 'plt_24h',
+]
+
+
+def encode_features(df, scaler, label_encoders, feature_cols):
+    """编码分类变量并标准化，返回模型输入矩阵（缺失值和缺失列保留为NaN）"""
+    df = df.reindex(columns=feature_cols)
+
+    # 处理分类变量（已编码为数值的列保持不变）
+    for col, encoder in label_encoders.items():
+        if col in df.columns and df[col].dtype == object:
+            present = df[col].notna().to_numpy()
+            codes = np.full(len(df), np.nan)
+            codes[present] = encoder.transform(df[col][present])
+            df[col] = codes
+
+    # 标准化
+    return scaler.transform(df)
+
+
+def missing_mask(df, feature_cols):
+    """每行一个 uint32 位掩码，第 i 位表示 feature_cols[i] 缺失（缺列视为整列缺失）"""
+    if len(feature_cols) > 32:
+        raise ValueError("缺失位掩码最多支持32个特征")
+    missing = df.reindex(columns=feature_cols).isna().to_numpy()
+    bits = np.left_shift(np.uint32(1), np.arange(len(feature_cols), dtype=np.uint32))
+    return (missing * bits).sum(axis=1, dtype=np.uint32)
+
+
+def missing_features(mask, feature_cols):
+    """单行位掩码解码为缺失特征名列表"""
+    mask = int(mask)
+    return [col for i, col in enumerate(feature_cols) if mask >> i & 1]
+
+
+def predict_proba_batch(model, scaler, label_encoders, feature_cols, df):
+    """批量预测手术概率，一次predict_proba调用完成所有行"""
+    X = encode_features(df, scaler, label_encoders, feature_cols)
+    return np.asarray(model.predict_proba(X)[:, 1], dtype=np.float64)
+
+
+def predict_with_missing(model, scaler, label_encoders, feature_cols, df):
+    """批量预测，同时返回每行的缺失位掩码（非零即该预测依赖了缺失输入）"""
+    return (predict_proba_batch(model, scaler, label_encoders, feature_cols, df),
+            missing_mask(df, feature_cols))
+
+
+# 批量结果的紧凑行格式：每行14字节（列式输出直接使用 score_columns 的各列数组）
+RESULT_DTYPE = np.dtype([
+    ('prob', np.float32),
+    ('tier', np.int8),
+    ('advice', np.uint32),
+    ('warnings', np.uint32),
+    ('missing', np.uint32),
+], align=False)
+
+
+class PredictionRecord:
+    """
+    单次预测结果
+
+    只保存概率、分层代码和三个位集（建议、警示、缺失），消息文本显示时
+    由进程内共享的规则表渲染，会话中不保留字符串列表或DataFrame。
+    """
+
+    __slots__ = ('prob', 'tier', 'advice', 'warnings', 'missing')
+
+    def __init__(self, prob, tier, advice=0, warnings=0, missing=0):
+        self.prob = float(prob)
+        self.tier = int(tier)
+        self.advice = int(advice)
+        self.warnings = int(warnings)
+        self.missing = int(missing)
+
+    @classmethod
+    def from_row(cls, row):
+        """从 RESULT_DTYPE 数组的一行构造"""
+        return cls(row['prob'], row['tier'], row['advice'], row['warnings'], row['missing'])
+
+
+def score_columns(model, scaler, label_encoders, feature_cols, df, thresholds=None):
+    """批量评分并求值建议/警示规则，返回 {字段: 连续数组}（字段和类型同 RESULT_DTYPE）"""
+    probs, missing = predict_with_missing(model, scaler, label_encoders, feature_cols, df)
+    tiers = risk_tier_codes(probs, thresholds or DEFAULT_RISK_THRESHOLDS)
+    rules_data = {c: df[c] for c in df.columns if c in feature_cols}
+    rules_data['risk_tier'] = tiers
+    return {
+        'prob': probs.astype(np.float32),
+        'tier': tiers,
+        'advice': evaluate_rules(rules_data, ADVICE_RULES),
+        'warnings': evaluate_rules(rules_data, WARNING_RULES),
+        'missing': missing,
+    }
+
+
+def score_batch(model, scaler, label_encoders, feature_cols, df, thresholds=None):
+    """批量评分，返回 RESULT_DTYPE 结构化数组（每行一条结果）"""
+    columns = score_columns(model, scaler, label_encoders, feature_cols, df, thresholds)
+    results = np.empty(len(df), dtype=RESULT_DTYPE)
+    for name in RESULT_DTYPE.names:
+        results[name] = columns[name]
+    return results
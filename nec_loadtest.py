@@ -0,0 +1,288 @@
+"""
+NEC手术风险预测 - 负载测试
+从回放文件（JSONL，每行一个患者输入）驱动N个并发客户端，测量吞吐量、延迟分位数、
+每会话内存和进程占用的CPU核数，并与保存的基线比较以发现版本间的性能回退
+
+两种模式：
+    api      多线程调用 ModelManager.predict（与Streamlit同进程内的预测路径一致）
+    session  每个客户端一个无头Streamlit会话（streamlit.testing），逐条填写输入并点击预测
+
+另有内存基准（--memory）：逐步打开 10/100/1000 个各完成一次预测的会话并保持存活，
+报告每个活动会话占用的字节数
+
+示例：
+    python nec_loadtest.py replay.jsonl --mode session --clients 20 --iterations 5
+    python nec_loadtest.py replay.jsonl --mode api --clients 50 --iterations 200 --save-baseline
+    python nec_loadtest.py replay.jsonl --memory 10,100,1000
+"""
+
+import argparse
+import gc
+import json
+import os
+import resource
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+
+import numpy as np
+import pandas as pd
+
+APP_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'nec_prediction_app_fixed.py')
+BASELINE_FILE = 'loadtest_baseline.json'
+
+# 与应用侧边栏默认值一致，回放记录中没有的字段用默认值补齐；
+# 值为 null（未检测）的字段保留为 None，回放时选入应用的"未检测项目"
+DEFAULT_INPUT = {
+    'crp_mgL_24h': 50.0,
+    'il6_pgml_24h': 500.0,
+    'fibrinogen_gL_24h': 3.0,
+    'glucose_mmolL_24h': 6.0,
+    'hco3_24h': 22.0,
+    'creatinine_24h': 50.0,
+    'hb_24h': 150.0,
+    'plt_24h': 200.0,
+    'xray_fixed_loops': 0,
+    'bw_cat': 'VLBW',
+}
+
+
+# 侧边栏中以下拉框输入、不能标为未检测的字段
+CATEGORICAL_INPUTS = ('xray_fixed_loops', 'bw_cat')
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def load_replay(path):
+    """读取回放文件，只保留模型输入字段（显式的 null 保留为 None，不用默认值代替）"""
+    records = []
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if not line.strip():
+                continue
+            row = json.loads(line)
+            records.append({k: row[k] if k in row else v for k, v in DEFAULT_INPUT.items()})
+    if not records:
+        raise ValueError(f"回放文件为空: {path}")
+    return records
+
+
+def rss_bytes():
+    """当前进程常驻内存（Linux读取/proc，其他平台退化为峰值RSS）"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class ApiClient:
+    """直接调用模型管理器的预测客户端"""
+
+    def __init__(self, manager, site_id):
+        self.manager = manager
+        self.site_id = site_id
+
+    def request(self, record):
+        self.manager.predict(self.site_id, pd.DataFrame([record]))
+        return True
+
+
+class SessionClient:
+    """无头Streamlit会话：一次 request 等价于填写侧边栏并点击预测按钮"""
+
+    def __init__(self, script=APP_SCRIPT, timeout=30):
+        from streamlit.testing.v1 import AppTest
+
+        self.app = AppTest.from_file(script, default_timeout=timeout)
+        self.app.run()
+
+    def request(self, record):
+        # 缺失的检验值（None/NaN）通过"未检测项目"多选框传入，而不是填写数值
+        missing = [key for key, value in record.items() if _is_missing(value)]
+        missing_labs = [key for key in missing if key not in CATEGORICAL_INPUTS]
+        selector = self.app.sidebar.multiselect('missing_labs')
+        if sorted(selector.value) != sorted(missing_labs):
+            # 未检测项目变化后先重跑一次，使重新检测的数值输入框解除禁用
+            selector.set_value(missing_labs)
+            self.app.run()
+        for key, value in record.items():
+            if key in missing:
+                continue
+            if key in CATEGORICAL_INPUTS:
+                self.app.sidebar.selectbox(key).set_value(value)
+            else:
+                self.app.sidebar.number_input(key).set_value(float(value))
+        self.app.sidebar.button[0].click()
+        self.app.run()
+        return not self.app.exception
+
+
+def run_load_test(records, make_client, n_clients, iterations):
+    """并发运行客户端，返回汇总指标"""
+    rss_start = rss_bytes()
+    with ThreadPoolExecutor(max_workers=n_clients) as pool:
+        clients = list(pool.map(lambda _: make_client(), range(n_clients)))
+    rss_sessions = rss_bytes()
+
+    latencies = [[] for _ in range(n_clients)]
+    errors = [0] * n_clients
+    barrier = threading.Barrier(n_clients)
+
+    def worker(i):
+        barrier.wait()
+        for j in range(iterations):
+            record = records[(i * iterations + j) % len(records)]
+            t0 = time.perf_counter()
+            try:
+                ok = clients[i].request(record)
+            except Exception:
+                ok = False
+            latencies[i].append(time.perf_counter() - t0)
+            errors[i] += not ok
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=n_clients) as pool:
+        list(pool.map(worker, range(n_clients)))
+    wall = time.perf_counter() - wall_start
+    cpu = time.process_time() - cpu_start
+
+    lat_ms = np.concatenate([np.asarray(l) for l in latencies]) * 1000
+    return {
+        'clients': n_clients,
+        'requests': int(lat_ms.size),
+        'errors': int(sum(errors)),
+        'throughput_rps': lat_ms.size / wall,
+        'latency_ms': {
+            'p50': float(np.percentile(lat_ms, 50)),
+            'p90': float(np.percentile(lat_ms, 90)),
+            'p95': float(np.percentile(lat_ms, 95)),
+            'p99': float(np.percentile(lat_ms, 99)),
+            'max': float(lat_ms.max()),
+        },
+        'over_1s_fraction': float(np.mean(lat_ms > 1000)),
+        'rss_per_session_mb': (rss_sessions - rss_start) / n_clients / 1e6,
+        'rss_total_mb': rss_bytes() / 1e6,
+        # 压测进程占用的CPU核数（CPU时间 / 墙钟时间）：会话在同一进程内受GIL约束，
+        # 以Python为主的负载接近1核即已饱和，不能按机器总核数折算
+        'cpu_cores_used': cpu / wall,
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def _count_instances(type_name):
+    """进程内某类型的对象个数（先解除 gc.freeze，否则冻结的对象不在统计范围内）"""
+    gc.unfreeze()
+    return sum(type(o).__name__ == type_name for o in gc.get_objects())
+
+
+def measure_session_memory(records, make_client=SessionClient, session_counts=(10, 100, 1000)):
+    """
+    内存基准：逐步打开会话（每个会话完成一次预测后保持存活），报告各会话数下每会话的字节数
+
+    先用一个预热会话加载模型、缓存等进程级共享资源，之后的RSS增量只包含会话自身的状态；
+    同时统计进程内的模型对象个数，验证模型只加载了一次。
+    """
+    warm = make_client()
+    warm.request(records[0])
+    del warm
+    gc.collect()
+    rss_start = rss_bytes()
+
+    sessions = []
+    steps = []
+    for target in sorted(session_counts):
+        while len(sessions) < target:
+            client = make_client()
+            client.request(records[len(sessions) % len(records)])
+            sessions.append(client)
+        gc.collect()
+        rss = rss_bytes()
+        steps.append({
+            'sessions': target,
+            'bytes_per_session': (rss - rss_start) / target,
+            'rss_total_mb': rss / 1e6,
+        })
+    return {
+        'memory': steps,
+        'model_instances': _count_instances('XGBClassifier'),
+    }
+
+
+def compare_to_baseline(report, baseline, tolerance=0.2):
+    """与基线比较，返回回退描述列表（为空表示无回退）"""
+    regressions = []
+    if 'memory' in report:
+        old, new = baseline['memory'][-1]['bytes_per_session'], report['memory'][-1]['bytes_per_session']
+        if new > old * (1 + tolerance):
+            regressions.append(f"每会话内存: {old / 1024:.0f} KB -> {new / 1024:.0f} KB")
+        return regressions
+    for q in ('p50', 'p95', 'p99'):
+        old, new = baseline['latency_ms'][q], report['latency_ms'][q]
+        if new > old * (1 + tolerance):
+            regressions.append(f"延迟 {q}: {old:.1f} ms -> {new:.1f} ms")
+    if report['throughput_rps'] < baseline['throughput_rps'] * (1 - tolerance):
+        regressions.append(f"吞吐量: {baseline['throughput_rps']:.1f} -> {report['throughput_rps']:.1f} req/s")
+    if report['rss_per_session_mb'] > baseline['rss_per_session_mb'] * (1 + tolerance) + 1:
+        regressions.append(f"每会话内存: {baseline['rss_per_session_mb']:.1f} -> "
+                           f"{report['rss_per_session_mb']:.1f} MB")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="NEC预测负载测试")
+    parser.add_argument('replay', help="回放文件（JSONL）")
+    parser.add_argument('--mode', choices=['api', 'session'], default='session')
+    parser.add_argument('--clients', type=int, default=10, help="并发客户端数")
+    parser.add_argument('--iterations', type=int, default=5, help="每个客户端的请求数")
+    parser.add_argument('--site', default='default', help="api模式使用的院区ID")
+    parser.add_argument('--baseline', default=BASELINE_FILE, help="基线文件路径")
+    parser.add_argument('--save-baseline', action='store_true', help="将本次结果保存为基线")
+    parser.add_argument('--tolerance', type=float, default=0.2, help="允许的回退比例")
+    parser.add_argument('--memory', default=None, metavar='N1,N2,...',
+                        help="运行会话内存基准，参数为会话数列表（如 10,100,1000）")
+    args = parser.parse_args()
+
+    records = load_replay(args.replay)
+    if args.memory:
+        key = 'memory'
+        report = measure_session_memory(records, session_counts=[int(n) for n in args.memory.split(',')])
+    else:
+        if args.mode == 'api':
+            from nec_model_manager import ModelManager
+
+            manager = ModelManager()
+            manager.get(args.site)
+            make_client = partial(ApiClient, manager, args.site)
+        else:
+            make_client = SessionClient
+        key = f"{args.mode}-{args.clients}"
+        report = run_load_test(records, make_client, args.clients, args.iterations)
+        report['mode'] = args.mode
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+    baselines = {}
+    if os.path.exists(args.baseline):
+        with open(args.baseline, encoding='utf-8') as f:
+            baselines = json.load(f)
+
+    status = 0
+    if args.save_baseline:
+        baselines[key] = report
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baselines, f, ensure_ascii=False, indent=2)
+        print(f"基线已保存: {args.baseline} [{key}]")
+    elif key in baselines:
+        regressions = compare_to_baseline(report, baselines[key], args.tolerance)
+        for r in regressions:
+            print(f"⚠️ 性能回退 {r}")
+        status = 1 if regressions else 0
+    raise SystemExit(status)
+
+
+if __name__ == "__main__":
+    main()
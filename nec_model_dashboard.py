@@ -0,0 +1,117 @@
+"""
+NEC手术风险预测 - 模型行为总览（质控管理页）
+展示全队列特征重要性、CRP/IL-6/HCO3依赖曲线及与出生体重分类的交互效应。
+数据来自 nec_global_explain.py 离线预计算的汇总数组，页面访问时不计算SHAP
+
+运行：
+    streamlit run nec_model_dashboard.py
+"""
+
+import os
+
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+from nec_global_explain import EXPLANATIONS_FILE, load_global_explanations
+from nec_model_manager import DEFAULT_SITE, ModelManager
+from nec_report import FEATURE_NAMES_EN
+
+# 样本数少于此值的分箱不绘制
+MIN_BIN_COUNT = 5
+
+st.set_page_config(
+    page_title="NEC模型行为总览",
+    page_icon="📊",
+    layout="wide",
+)
+
+
+@st.cache_resource
+def get_model_manager():
+    """进程内共享的院区列表与模型版本查询（不加载模型）"""
+    return ModelManager()
+
+
+@st.cache_resource
+def get_explanations(path, mtime):
+    """进程内共享的汇总数组，文件更新（mtime变化）后重新读取"""
+    return load_global_explanations(path)
+
+
+def feature_label(name):
+    return FEATURE_NAMES_EN.get(name, name)
+
+
+def bin_centers(edges):
+    """分箱中点，作为依赖曲线的横坐标"""
+    return np.round((edges[:-1] + edges[1:]) / 2, 2)
+
+
+model_manager = get_model_manager()
+site_options = model_manager.list_sites()
+site_id = st.sidebar.selectbox("🏥 院区", options=site_options) if len(site_options) > 1 else DEFAULT_SITE
+
+path = model_manager.artifact_path(site_id, EXPLANATIONS_FILE)
+summary = get_explanations(path, os.path.getmtime(path)) if os.path.exists(path) else None
+
+st.title("📊 模型行为总览")
+
+if summary is None:
+    st.info(f"院区 {site_id} 尚未预计算全队列解释，请先运行：\n\n"
+            f"`python nec_global_explain.py cohort.csv --site {site_id}`")
+    st.stop()
+
+model_version = str(summary['model_version'])
+col1, col2, col3 = st.columns(3)
+col1.metric("队列例数", f"{int(summary['n_rows']):,}")
+col2.metric("交互值抽样例数", f"{int(summary['n_interaction_rows']):,}")
+col3.metric("计算时间", str(summary['computed_at']))
+if model_version != model_manager.bundle_hash(site_id):
+    st.warning(f"⚠️ 汇总基于旧模型版本（{model_version[:12]}），当前模型已更新，请重新运行离线计算")
+
+feature_cols = [str(f) for f in summary['feature_cols']]
+labels = [feature_label(f) for f in feature_cols]
+tab_importance, tab_dependence, tab_interaction = st.tabs(["特征重要性", "依赖曲线", "与出生体重的交互"])
+
+with tab_importance:
+    st.caption("平均|SHAP|（logit尺度）：特征对个体预测的平均影响幅度")
+    order = summary['importance_rank']
+    importance = pd.DataFrame({
+        '特征': [labels[j] for j in order],
+        '平均|SHAP|': summary['importance'][order],
+        '平均SHAP': summary['mean_shap'][order],
+        '与bw_cat交互': summary['interaction_strength'][order],
+    })
+    st.bar_chart(importance, x='特征', y='平均|SHAP|', horizontal=True)
+    st.dataframe(importance.round(3), use_container_width=True, hide_index=True)
+
+dependence_features = [str(f) for f in summary['dependence_features']]
+
+with tab_dependence:
+    d = st.selectbox("特征", range(len(dependence_features)), format_func=lambda i: feature_label(dependence_features[i]),
+                     key='dependence_feature')
+    count = summary['bin_count'][d]
+    mean = np.where(count >= MIN_BIN_COUNT, summary['bin_mean_shap'][d], np.nan)
+    std = summary['bin_std_shap'][d]
+    curve = pd.DataFrame({'SHAP均值': mean[:-1], '+1 SD': (mean + std)[:-1], '-1 SD': (mean - std)[:-1]},
+                         index=pd.Index(bin_centers(summary['bin_edges'][d]), name=feature_label(dependence_features[d])))
+    st.caption("按原始单位分位数分箱的SHAP均值（正值推高手术风险）")
+    st.line_chart(curve)
+    if count[-1]:
+        st.markdown(f"**未检测**（{int(count[-1])} 例）：SHAP均值 {summary['bin_mean_shap'][d][-1]:+.3f}")
+
+with tab_interaction:
+    st.caption("SHAP交互值 φ(特征, bw_cat)：该特征的效应随出生体重分类的变化")
+    strength = pd.DataFrame({'特征': labels, '交互强度': summary['interaction_strength']})
+    strength = strength.drop(index=feature_cols.index('bw_cat')).sort_values('交互强度', ascending=False)
+    st.bar_chart(strength, x='特征', y='交互强度', horizontal=True)
+
+    d = st.selectbox("特征", range(len(dependence_features)), format_func=lambda i: feature_label(dependence_features[i]),
+                     key='interaction_feature')
+    groups = [str(g) for g in summary['interaction_groups']]
+    count = summary['interaction_count'][d]
+    mean = np.where(count >= MIN_BIN_COUNT, summary['interaction_mean'][d], np.nan)
+    curves = pd.DataFrame({groups[g]: mean[g, :-1] for g in range(len(groups)) if count[g].sum()},
+                          index=pd.Index(bin_centers(summary['bin_edges'][d]), name=feature_label(dependence_features[d])))
+    st.line_chart(curves)
@@ -0,0 +1,200 @@
+"""
+NEC手术风险预测 - 多院区模型管理
+按院区ID按需加载模型包（模型、标准化器、编码器、特征列表），
+内容相同的文件按哈希共享，超出内存预算时按LRU淘汰冷门院区
+"""
+
+import gc
+import hashlib
+import os
+import threading
+from collections import OrderedDict
+
+import joblib
+
+from nec_inference import predict_proba_batch
+
+# 模型包中的四个文件
+ARTIFACT_FILES = {
+    'model': 'xgboost_model.pkl',
+    'scaler': 'scaler.pkl',
+    'label_encoders': 'label_encoders.pkl',
+    'feature_cols': 'feature_cols.pkl',
+}
+
+# 可选文件：不存在时对应属性为 None
+OPTIONAL_ARTIFACT_FILES = {
+    'similar_cases': 'similar_cases.pkl',
+}
+
+# 在scaler标准化空间中构建的可选文件：院区使用自己的scaler时不能回退到根目录版本
+SCALER_DEPENDENT_FILES = {'similar_cases'}
+
+# 默认院区使用仓库根目录下的模型文件
+DEFAULT_SITE = 'default'
+
+
+def file_hash(path):
+    """计算文件内容的SHA-256"""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def bundle_digest(artifact_hashes):
+    """模型包哈希：四个必需文件哈希的组合，用作版本标识"""
+    return hashlib.sha256(''.join(artifact_hashes[k] for k in ARTIFACT_FILES).encode()).hexdigest()
+
+
+class ModelBundle:
+    """单个院区的模型包"""
+
+    def __init__(self, site_id, artifacts, artifact_hashes):
+        self.site_id = site_id
+        self.model = artifacts['model']
+        self.scaler = artifacts['scaler']
+        self.label_encoders = artifacts['label_encoders']
+        self.feature_cols = artifacts['feature_cols']
+        # 相似病例索引须与本院区scaler处于同一标准化空间（索引记录了构建时的scaler哈希）
+        similar_cases = artifacts.get('similar_cases')
+        built_with = similar_cases.get('scaler_hash') if similar_cases is not None else None
+        if built_with is not None and built_with != artifact_hashes['scaler']:
+            similar_cases = None
+        self.similar_cases = similar_cases
+        self.artifact_hashes = artifact_hashes
+        self.bundle_hash = bundle_digest(artifact_hashes)
+
+    def predict(self, df):
+        """批量预测手术概率"""
+        return predict_proba_batch(self.model, self.scaler, self.label_encoders,
+                                   self.feature_cols, df)
+
+
+class ModelManager:
+    """
+    多院区模型管理器
+
+    院区模型包位于 sites_dir/<site_id>/ 下，文件名与 ARTIFACT_FILES 一致；
+    缺失的文件回退到仓库根目录的同名文件。线程安全，可在Streamlit各会话间共享。
+    """
+
+    def __init__(self, sites_dir='sites', base_dir='.', memory_budget_mb=512):
+        self.sites_dir = sites_dir
+        self.base_dir = base_dir
+        self.memory_budget = memory_budget_mb * 1024 * 1024
+        self._bundles = OrderedDict()   # site_id -> ModelBundle，按最近使用排序
+        self._artifacts = {}            # 内容哈希 -> [对象, 字节数, 引用计数]
+        self._lock = threading.RLock()
+
+    def list_sites(self):
+        """列出可用院区"""
+        sites = [DEFAULT_SITE]
+        if os.path.isdir(self.sites_dir):
+            sites += sorted(
+                name for name in os.listdir(self.sites_dir)
+                if os.path.isdir(os.path.join(self.sites_dir, name))
+            )
+        return sites
+
+    def site_dir(self, site_id=DEFAULT_SITE):
+        """院区模型包目录（离线产物的保存位置），默认院区为根目录；未知院区抛出 KeyError"""
+        if site_id not in self.list_sites():
+            raise KeyError(f"未知院区: {site_id}")
+        return self.base_dir if site_id == DEFAULT_SITE else os.path.join(self.sites_dir, site_id)
+
+    def artifact_path(self, site_id, filename):
+        """院区文件路径，院区目录中没有时回退到根目录"""
+        if site_id != DEFAULT_SITE:
+            path = os.path.join(self.sites_dir, site_id, filename)
+            if os.path.exists(path):
+                return path
+        return os.path.join(self.base_dir, filename)
+
+    def bundle_hash(self, site_id=DEFAULT_SITE):
+        """院区模型包哈希，未加载时只计算文件哈希而不加载模型"""
+        with self._lock:
+            if site_id in self._bundles:
+                return self._bundles[site_id].bundle_hash
+        return bundle_digest({key: file_hash(self.artifact_path(site_id, filename))
+                              for key, filename in ARTIFACT_FILES.items()})
+
+    def _same_space(self, site_id, path, scaler_hash):
+        """回退到根目录的文件只在院区scaler与根目录scaler相同时可用"""
+        if site_id == DEFAULT_SITE or path != os.path.join(self.base_dir, os.path.basename(path)):
+            return True
+        return scaler_hash == file_hash(os.path.join(self.base_dir, ARTIFACT_FILES['scaler']))
+
+    def memory_usage(self):
+        """当前已加载文件的总字节数（共享文件只计一次）"""
+        with self._lock:
+            return sum(entry[1] for entry in self._artifacts.values())
+
+    def get(self, site_id=DEFAULT_SITE):
+        """获取院区模型包，未加载时从磁盘加载"""
+        with self._lock:
+            if site_id in self._bundles:
+                self._bundles.move_to_end(site_id)
+                return self._bundles[site_id]
+
+            if site_id not in self.list_sites():
+                raise KeyError(f"未知院区: {site_id}")
+
+            artifacts = {}
+            hashes = {}
+            files = dict(ARTIFACT_FILES, **OPTIONAL_ARTIFACT_FILES)
+            for key, filename in files.items():
+                path = self.artifact_path(site_id, filename)
+                if key in OPTIONAL_ARTIFACT_FILES and not os.path.exists(path):
+                    continue
+                if key in SCALER_DEPENDENT_FILES and not self._same_space(site_id, path, hashes['scaler']):
+                    continue
+                digest = file_hash(path)
+                entry = self._artifacts.get(digest)
+                if entry is None:
+                    entry = [joblib.load(path), os.path.getsize(path), 0]
+                    self._artifacts[digest] = entry
+                entry[2] += 1
+                artifacts[key] = entry[0]
+                hashes[key] = digest
+
+            bundle = ModelBundle(site_id, artifacts, hashes)
+            self._bundles[site_id] = bundle
+            self._evict(keep=site_id)
+            return bundle
+
+    def preload(self, site_ids=None):
+        """
+        预加载院区模型包（默认全部院区，受内存预算约束）并冻结GC
+
+        在Streamlit启动或派生工作进程前调用：gc.freeze() 将已加载对象移出垃圾回收跟踪，
+        fork出的子进程通过写时复制共享模型内存，GC扫描不会触碰这些页面。
+        """
+        for site_id in site_ids or self.list_sites():
+            self.get(site_id)
+        gc.freeze()
+
+    def _evict(self, keep):
+        """超出内存预算时淘汰最久未使用的院区（至少保留当前院区）"""
+        while self.memory_usage() > self.memory_budget and len(self._bundles) > 1:
+            site_id = next(iter(self._bundles))
+            if site_id == keep:
+                break
+            self.unload(site_id)
+
+    def unload(self, site_id):
+        """卸载院区模型包，释放不再被引用的文件"""
+        with self._lock:
+            bundle = self._bundles.pop(site_id, None)
+            if bundle is None:
+                return
+            for digest in bundle.artifact_hashes.values():
+                entry = self._artifacts[digest]
+                entry[2] -= 1
+                if entry[2] == 0:
+                    del self._artifacts[digest]
+
+    def predict(self, site_id, df):
+        """按院区路由的批量预测接口"""
+        return self.get(site_id).predict(df)
@@ -21,6 +21,9 @@ import pickle
 import os
 from sklearn.preprocessing import StandardScaler, LabelEncoder
 
+from nec_rules import SEVERITY_WARNING, evaluate_rules, render_messages
+from nec_thresholds import load_thresholds
+
 try:
     import shap
     HAS_SHAP = True
@@ -195,6 +198,60 @@ FEATURE_INFO = {
     }
 }
 
+def _normal_range_text(key):
+    lo, hi = FEATURE_INFO[key]['normal']
+    return f"{lo}-{hi} {FEATURE_INFO[key]['unit']}"
+
+# 输入指标异常提示规则表：(特征, 运算符, 阈值, 严重程度, 消息)
+INPUT_WARNING_RULES = [
+    ('CRP', '>', FEATURE_INFO['CRP']['normal'][1], SEVERITY_WARNING,
+     f"⚠️ CRP升高（正常值: {FEATURE_INFO['CRP']['normal'][1]} {FEATURE_INFO['CRP']['unit']}以下）"),
+    ('IL6', '>', FEATURE_INFO['IL6']['normal'][1], SEVERITY_WARNING,
+     f"⚠️ IL-6升高（正常值: {FEATURE_INFO['IL6']['normal'][1]} {FEATURE_INFO['IL6']['unit']}以下）"),
+    ('fibrinogen', '<', FEATURE_INFO['fibrinogen']['normal'][0], SEVERITY_WARNING,
+     f"⚠️ 纤维蛋白原异常（正常范围: {_normal_range_text('fibrinogen')}）"),
+    ('fibrinogen', '>', FEATURE_INFO['fibrinogen']['normal'][1], SEVERITY_WARNING,
+     f"⚠️ 纤维蛋白原异常（正常范围: {_normal_range_text('fibrinogen')}）"),
+    ('glucose', '<', FEATURE_INFO['glucose']['normal'][0], SEVERITY_WARNING,
+     f"⚠️ 血糖异常（正常范围: {_normal_range_text('glucose')}）"),
+    ('glucose', '>', FEATURE_INFO['glucose']['normal'][1], SEVERITY_WARNING,
+     f"⚠️ 血糖异常（正常范围: {_normal_range_text('glucose')}）"),
+    ('HCO3', '<', FEATURE_INFO['HCO3']['normal'][0], SEVERITY_WARNING,
+     f"⚠️ 代谢性酸中毒（正常范围: {_normal_range_text('HCO3')}）"),
+    ('creatinine', '>', FEATURE_INFO['creatinine']['normal'][1], SEVERITY_WARNING,
+     f"⚠️ 肾功能异常（正常值: {FEATURE_INFO['creatinine']['normal'][1]} {FEATURE_INFO['creatinine']['unit']}以下）"),
+    ('hemoglobin', '<', FEATURE_INFO['hemoglobin']['normal'][0], SEVERITY_WARNING,
+     f"⚠️ 贫血（正常范围: {_normal_range_text('hemoglobin')}）"),
+    ('platelets', '<', FEATURE_INFO['platelets']['normal'][0], SEVERITY_WARNING,
+     f"⚠️ 血小板减少（正常范围: {_normal_range_text('platelets')}）"),
+]
+
+def show_input_warnings(feature, value):
+    """按规则表显示单个输入指标的异常提示"""
+    rules = [rule for rule in INPUT_WARNING_RULES if rule[0] == feature]
+    codes = evaluate_rules({feature: [value]}, rules)
+    for message in render_messages(codes[0], rules):
+        st.warning(message)
+
+# 可标记为"未检测"的实验室指标
+LAB_FEATURES = ['CRP', 'IL6', 'fibrinogen', 'glucose', 'HCO3', 'creatinine', 'hemoglobin', 'platelets']
+
+def lab_number_input(feature, missing_labs):
+    """实验室指标输入框；标记为未检测时禁用并返回NaN（不以默认值代替）"""
+    info = FEATURE_INFO[feature]
+    value = st.number_input(
+        f"{info['name']} ({info['unit']})",
+        min_value=info['range'][0],
+        max_value=info['range'][1],
+        value=info['default'],
+        disabled=feature in missing_labs,
+        help=info['help']
+    )
+    if feature in missing_labs:
+        return np.nan
+    show_input_warnings(feature, value)
+    return value
+
 # ============================================================================
 # 主程序
 # ============================================================================
@@ -245,6 +302,13 @@ def main():
     # 输入表单
     st.header("📝 患者信息输入")
     
+    missing_labs = st.multiselect(
+        "未检测项目",
+        LAB_FEATURES,
+        format_func=lambda feature: FEATURE_INFO[feature]['name'],
+        help="未检测的指标按缺失处理，不计入风险评估，结果会标注依赖缺失值"
+    )
+    
     # 创建两列布局
     col1, col2 = st.columns(2)
     
@@ -275,104 +339,40 @@ def main():
         st.subheader("炎症指标")
         
         # CRP
-        crp = st.number_input(
-            f"{FEATURE_INFO['CRP']['name']} ({FEATURE_INFO['CRP']['unit']})",
-            min_value=FEATURE_INFO['CRP']['range'][0],
-            max_value=FEATURE_INFO['CRP']['range'][1],
-            value=FEATURE_INFO['CRP']['default'],
-            help=FEATURE_INFO['CRP']['help']
-        )
-        if crp > FEATURE_INFO['CRP']['normal'][1]:
-            st.warning(f"⚠️ CRP升高（正常值: {FEATURE_INFO['CRP']['normal'][1]} {FEATURE_INFO['CRP']['unit']}以下）")
+        crp = lab_number_input('CRP', missing_labs)
         input_data['CRP'] = crp
         
         # IL-6
-        il6 = st.number_input(
-            f"{FEATURE_INFO['IL6']['name']} ({FEATURE_INFO['IL6']['unit']})",
-            min_value=FEATURE_INFO['IL6']['range'][0],
-            max_value=FEATURE_INFO['IL6']['range'][1],
-            value=FEATURE_INFO['IL6']['default'],
-            help=FEATURE_INFO['IL6']['help']
-        )
-        if il6 > FEATURE_INFO['IL6']['normal'][1]:
-            st.warning(f"⚠️ IL-6升高（正常值: {FEATURE_INFO['IL6']['normal'][1]} {FEATURE_INFO['IL6']['unit']}以下）")
+        il6 = lab_number_input('IL6', missing_labs)
         input_data['IL6'] = il6
         
         # 纤维蛋白原
-        fib = st.number_input(
-            f"{FEATURE_INFO['fibrinogen']['name']} ({FEATURE_INFO['fibrinogen']['unit']})",
-            min_value=FEATURE_INFO['fibrinogen']['range'][0],
-            max_value=FEATURE_INFO['fibrinogen']['range'][1],
-            value=FEATURE_INFO['fibrinogen']['default'],
-            help=FEATURE_INFO['fibrinogen']['help']
-        )
-        if fib < FEATURE_INFO['fibrinogen']['normal'][0] or fib > FEATURE_INFO['fibrinogen']['normal'][1]:
-            st.warning(f"⚠️ 纤维蛋白原异常（正常范围: {FEATURE_INFO['fibrinogen']['normal'][0]}-{FEATURE_INFO['fibrinogen']['normal'][1]} {FEATURE_INFO['fibrinogen']['unit']}）")
+        fib = lab_number_input('fibrinogen', missing_labs)
         input_data['fibrinogen'] = fib
     
     with col2:
         st.subheader("代谢指标")
         
         # 血糖
-        glucose = st.number_input(
-            f"{FEATURE_INFO['glucose']['name']} ({FEATURE_INFO['glucose']['unit']})",
-            min_value=FEATURE_INFO['glucose']['range'][0],
-            max_value=FEATURE_INFO['glucose']['range'][1],
-            value=FEATURE_INFO['glucose']['default'],
-            help=FEATURE_INFO['glucose']['help']
-        )
-        if glucose < FEATURE_INFO['glucose']['normal'][0] or glucose > FEATURE_INFO['glucose']['normal'][1]:
-            st.warning(f"⚠️ 血糖异常（正常范围: {FEATURE_INFO['glucose']['normal'][0]}-{FEATURE_INFO['glucose']['normal'][1]} {FEATURE_INFO['glucose']['unit']}）")
+        glucose = lab_number_input('glucose', missing_labs)
         input_data['glucose'] = glucose
         
         # 碳酸氢根
-        hco3 = st.number_input(
-            f"{FEATURE_INFO['HCO3']['name']} ({FEATURE_INFO['HCO3']['unit']})",
-            min_value=FEATURE_INFO['HCO3']['range'][0],
-            max_value=FEATURE_INFO['HCO3']['range'][1],
-            value=FEATURE_INFO['HCO3']['default'],
-            help=FEATURE_INFO['HCO3']['help']
-        )
-        if hco3 < FEATURE_INFO['HCO3']['normal'][0]:
-            st.warning(f"⚠️ 代谢性酸中毒（正常范围: {FEATURE_INFO['HCO3']['normal'][0]}-{FEATURE_INFO['HCO3']['normal'][1]} {FEATURE_INFO['HCO3']['unit']}）")
+        hco3 = lab_number_input('HCO3', missing_labs)
         input_data['HCO3'] = hco3
         
         # 肌酐
-        creat = st.number_input(
-            f"{FEATURE_INFO['creatinine']['name']} ({FEATURE_INFO['creatinine']['unit']})",
-            min_value=FEATURE_INFO['creatinine']['range'][0],
-            max_value=FEATURE_INFO['creatinine']['range'][1],
-            value=FEATURE_INFO['creatinine']['default'],
-            help=FEATURE_INFO['creatinine']['help']
-        )
-        if creat > FEATURE_INFO['creatinine']['normal'][1]:
-            st.warning(f"⚠️ 肾功能异常（正常值: {FEATURE_INFO['creatinine']['normal'][1]} {FEATURE_INFO['creatinine']['unit']}以下）")
+        creat = lab_number_input('creatinine', missing_labs)
         input_data['creatinine'] = creat
         
         st.subheader("血液学指标")
         
         # 血红蛋白
-        hgb = st.number_input(
-            f"{FEATURE_INFO['hemoglobin']['name']} ({FEATURE_INFO['hemoglobin']['unit']})",
-            min_value=FEATURE_INFO['hemoglobin']['range'][0],
-            max_value=FEATURE_INFO['hemoglobin']['range'][1],
-            value=FEATURE_INFO['hemoglobin']['default'],
-            help=FEATURE_INFO['hemoglobin']['help']
-        )
-        if hgb < FEATURE_INFO['hemoglobin']['normal'][0]:
-            st.warning(f"⚠️ 贫血（正常范围: {FEATURE_INFO['hemoglobin']['normal'][0]}-{FEATURE_INFO['hemoglobin']['normal'][1]} {FEATURE_INFO['hemoglobin']['unit']}）")
+        hgb = lab_number_input('hemoglobin', missing_labs)
         input_data['hemoglobin'] = hgb
         
         # 血小板
-        plt_count = st.number_input(
-            f"{FEATURE_INFO['platelets']['name']} ({FEATURE_INFO['platelets']['unit']})",
-            min_value=FEATURE_INFO['platelets']['range'][0],
-            max_value=FEATURE_INFO['platelets']['range'][1],
-            value=FEATURE_INFO['platelets']['default'],
-            help=FEATURE_INFO['platelets']['help']
-        )
-        if plt_count < FEATURE_INFO['platelets']['normal'][0]:
-            st.warning(f"⚠️ 血小板减少（正常范围: {FEATURE_INFO['platelets']['normal'][0]}-{FEATURE_INFO['platelets']['normal'][1]} {FEATURE_INFO['platelets']['unit']}）")
+        plt_count = lab_number_input('platelets', missing_labs)
         input_data['platelets'] = plt_count
     
     st.markdown("---")
@@ -436,12 +436,13 @@ def main():
         st.header("📋 预测结果")
         
         # 风险等级判定
-        if predicted_prob < 0.3:
+        medium_threshold, high_threshold = load_thresholds()
+        if predicted_prob < medium_threshold:
             risk_level = "低风险"
             risk_color = "low"
             risk_emoji = "✅"
             risk_desc = "72小时内需要手术的概率较低"
-        elif predicted_prob < 0.7:
+        elif predicted_prob < high_threshold:
             risk_level = "中风险"
             risk_color = "medium"
             risk_emoji = "⚠️"
@@ -460,7 +461,11 @@ def main():
             <p style="font-size: 1.1rem; margin-top: 1rem;">{risk_desc}</p>
         </div>
         """, unsafe_allow_html=True)
-        
+
+        if missing_labs:
+            missing_names = '、'.join(FEATURE_INFO[feature]['name'] for feature in missing_labs)
+            st.warning(f"⚠️ 本次预测依赖缺失值：{missing_names} 未检测，可靠性降低，建议补充检验后重新评估")
+
         # 详细指标
         col1, col2, col3 = st.columns(3)
         
@@ -554,7 +559,7 @@ def main():
         st.markdown("---")
         st.header("💡 临床建议")
         
-        if predicted_prob >= 0.7:
+        if predicted_prob >= high_threshold:
             st.markdown("""
             <div class="warning-box">
             <h3>🚨 高风险患者管理建议</h3>
@@ -567,7 +572,7 @@ def main():
             </ul>
             </div>
             """, unsafe_allow_html=True)
-        elif predicted_prob >= 0.3:
+        elif predicted_prob >= medium_threshold:
             st.markdown("""
             <div class="warning-box">
             <h3>⚠️ 中风险患者管理建议</h3>
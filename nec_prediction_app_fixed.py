@@ -8,8 +8,19 @@ import streamlit as st
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
-import joblib
+from matplotlib.figure import Figure
 import os
+import time
+
+from nec_inference import FEATURE_COLS, PredictionRecord, missing_mask, predict_proba_batch
+from nec_counterfactual import search_counterfactuals, format_suggestion
+from nec_model_manager import ModelManager, DEFAULT_SITE
+from nec_similar_cases import find_similar_cases
+from nec_scorecard import SCORECARD_FILE, format_fidelity, load_scorecard, predict_proba as scorecard_predict_proba
+from nec_cache import PredictionCache
+from nec_alerts import read_alerts
+from nec_thresholds import THRESHOLDS_FILE, load_thresholds
+from nec_rules import ADVICE_RULES, WARNING_RULES, evaluate_rules, render_messages, risk_tier_codes
 
 # 配置matplotlib使用英文显示（避免中文乱码）
 plt.rcParams['font.family'] = ['DejaVu Sans']
@@ -56,95 +67,143 @@ st.markdown("""
 
 # 加载模型和预处理器
 @st.cache_resource
-def load_model():
-    """加载训练好的模型和预处理器"""
+def get_model_manager():
+    """进程内共享的多院区模型管理器（启动时预加载默认院区，各会话只持有引用）"""
+    manager = ModelManager()
+    try:
+        manager.preload([DEFAULT_SITE])
+    except (FileNotFoundError, ImportError):
+        # 模型不可用时由 load_model 回退到评分卡
+        pass
+    return manager
+
+model_manager = get_model_manager()
+
+# 院区选择（仅在配置了多个院区时显示）
+site_options = model_manager.list_sites()
+if len(site_options) > 1:
+    site_id = st.sidebar.selectbox("🏥 院区", options=site_options,
+                                   help="按院区加载对应的重新校准模型")
+else:
+    site_id = DEFAULT_SITE
+
+def load_model(site_id):
+    """加载指定院区的模型和预处理器"""
     try:
-        model = joblib.load('xgboost_model.pkl')
-        scaler = joblib.load('scaler.pkl')
-        label_encoders = joblib.load('label_encoders.pkl')
-        feature_cols = joblib.load('feature_cols.pkl')
-        return model, scaler, label_encoders, feature_cols, True
-    except FileNotFoundError:
-        st.warning("⚠️ 模型文件未找到，使用模拟预测模式")
+        bundle = model_manager.get(site_id)
+        return bundle.model, bundle.scaler, bundle.label_encoders, bundle.feature_cols, True
+    except (FileNotFoundError, ImportError):
+        st.warning("⚠️ 模型文件或XGBoost环境不可用，使用蒸馏评分卡预测")
         return None, None, None, None, False
 
-model, scaler, label_encoders, feature_cols, model_loaded = load_model()
+model, scaler, label_encoders, feature_cols, model_loaded = load_model(site_id)
+risk_thresholds = load_thresholds(model_manager.artifact_path(site_id, THRESHOLDS_FILE))
+@st.cache_resource
+def get_scorecard(path):
+    """进程内共享的蒸馏评分卡"""
+    return load_scorecard(path)
+
+scorecard = None if model_loaded else get_scorecard(model_manager.artifact_path(site_id, SCORECARD_FILE))
+bundle_hash = model_manager.get(site_id).bundle_hash if model_loaded else None
+similar_index = model_manager.get(site_id).similar_cases if model_loaded else None
+
+@st.cache_resource
+def get_prediction_cache():
+    """跨会话、跨重启共享的持久化预测缓存，启动时预热热点条目"""
+    cache = PredictionCache()
+    cache.warm_up()
+    return cache
+
+prediction_cache = get_prediction_cache()
 
 def predict_risk(input_data):
     """预测手术风险"""
     if model_loaded:
         # 使用真实模型预测
         try:
-            # 准备数据
-            df = pd.DataFrame([input_data])
+            cached = prediction_cache.get('prob', bundle_hash, input_data)
+            if cached is not None:
+                return cached
             
-            # 处理分类变量
-            if 'bw_cat' in label_encoders:
-                df['bw_cat'] = label_encoders['bw_cat'].transform(df['bw_cat'])
-            
-            # 标准化
-            df_scaled = scaler.transform(df[feature_cols])
-            
-            # 预测
-            prob = model.predict_proba(df_scaled)[0, 1]
-            return float(prob)
+            # 准备数据并预测
+            df = pd.DataFrame([input_data])
+            prob = float(predict_proba_batch(model, scaler, label_encoders, feature_cols, df)[0])
+            prediction_cache.put('prob', bundle_hash, input_data, prob)
+            return prob
         except Exception as e:
             st.error(f"预测错误: {str(e)}")
             return None
     else:
-        # 模拟预测（当模型文件不可用时）
-        risk_score = 0
-        risk_score += min(input_data['crp_mgL_24h'] / 200, 1) * 0.20
-        risk_score += min(input_data['il6_pgml_24h'] / 2000, 1) * 0.20
-        risk_score += min(input_data['fibrinogen_gL_24h'] / 10, 1) * 0.15
-        risk_score += (1 - min(input_data['hco3_24h'] / 30, 1)) * 0.15
-        risk_score += min(input_data['creatinine_24h'] / 150, 1) * 0.10
-        risk_score += (1 - min(input_data['hb_24h'] / 180, 1)) * 0.10
-        risk_score += (1 - min(input_data['plt_24h'] / 400, 1)) * 0.05
-        risk_score += input_data['xray_fixed_loops'] * 0.05
-        return min(max(risk_score, 0.05), 0.95)
+        # 蒸馏评分卡预测（XGBoost不可用时）
+        return scorecard_predict_proba(scorecard, input_data)
 
 def get_risk_category(prob):
     """根据概率确定风险分类"""
-    if prob >= 0.7:
+    medium, high = risk_thresholds
+    if prob >= high:
         return "高风险", "risk-high", "#f44336"
-    elif prob >= 0.4:
+    elif prob >= medium:
         return "中风险", "risk-medium", "#ff9800"
     else:
         return "低风险", "risk-low", "#4caf50"
 
-def get_clinical_advice(prob, input_data):
-    """生成个性化临床建议"""
-    category, _, _ = get_risk_category(prob)
-    
-    advice = []
-    
-    if category == "高风险":
-        advice.append("🚨 **立即建议**：患者需要外科会诊评估手术指征")
-        advice.append("📊 **监测重点**：密切监测生命体征和腹部体征变化")
-        advice.append("💊 **治疗建议**：确保充分的液体复苏和抗生素治疗")
-    elif category == "中风险":
-        advice.append("⚠️ **建议**：加强监测，考虑外科会诊")
-        advice.append("📊 **监测频率**：每2-4小时评估一次腹部体征")
-        advice.append("💊 **治疗优化**：优化内科保守治疗方案")
-    else:
-        advice.append("✅ **当前状态**：继续内科保守治疗")
-        advice.append("📊 **常规监测**：按标准频率监测生命体征")
-        advice.append("💊 **治疗方案**：维持当前治疗方案")
+def evaluate_prediction(prob, input_data):
+    """
+    预测结果记录：分层代码和建议/警示/缺失位集，消息在显示时由规则表渲染
+
+    缺失位掩码按模型的 feature_cols 顺序编码（评分卡回退时用规范顺序 FEATURE_COLS），
+    与 score_batch、nec_export 和 missing_features 一致
+    """
+    data = {feature: [value] for feature, value in input_data.items()}
+    data['risk_tier'] = risk_tier_codes([prob], risk_thresholds)
+    return PredictionRecord(
+        prob,
+        data['risk_tier'][0],
+        advice=evaluate_rules(data, ADVICE_RULES)[0],
+        warnings=evaluate_rules(data, WARNING_RULES)[0],
+        missing=missing_mask(pd.DataFrame([input_data]), feature_cols or FEATURE_COLS)[0],
+    )
+
+def show_contribution_chart(features, color):
+    """
+    绘制特征贡献条形图
+
+    图表为函数内的局部Figure（不经pyplot注册），返回后连同渲染缓冲区一起释放，不随会话保留
+    """
+    fig = Figure(figsize=(10, 6))
+    ax = fig.subplots()
+    colors_list = [color if v > 0.5 else '#4caf50' for v in features.values()]
+    bars = ax.barh(list(features.keys()), list(features.values()), color=colors_list)
+    ax.set_xlabel('Contribution Score', fontsize=12)
+    ax.set_title('Feature Contributions to Surgical Risk', fontsize=14, fontweight='bold')
+    ax.set_xlim(0, 1)
     
-    # 根据异常指标添加特定建议
-    if input_data['crp_mgL_24h'] > 100:
-        advice.append("⚕️ **炎症指标**：CRP显著升高，注意感染控制")
-    if input_data['il6_pgml_24h'] > 1000:
-        advice.append("⚕️ **炎症因子**：IL-6显著升高，提示强烈炎症反应")
-    if input_data['hco3_24h'] < 18:
-        advice.append("⚕️ **代谢状态**：代谢性酸中毒，注意纠正")
-    if input_data['plt_24h'] < 100:
-        advice.append("⚕️ **凝血功能**：血小板减少，警惕DIC")
-    if input_data['xray_fixed_loops'] == 1:
-        advice.append("⚕️ **影像学**：存在固定肠襻，需密切观察")
+    # 添加数值标签
+    for i, (bar, value) in enumerate(zip(bars, features.values())):
+        ax.text(value + 0.02, i, f'{value:.2f}', va='center', fontsize=10)
     
-    return advice
+    fig.tight_layout()
+    st.pyplot(fig)
+
+# 提醒面板的轮询间隔（秒）
+ALERT_POLL_SECONDS = 15
+
+@st.fragment(run_every=ALERT_POLL_SECONDS)
+def show_alerts():
+    """风险等级变化提醒：片段定时重跑读取提醒文件，打开的会话无需操作即可看到新提醒"""
+    subscribed = st.text_input("订阅患者ID（逗号分隔）", key="alert_patient_ids")
+    patient_ids = [p.strip() for p in subscribed.split(",") if p.strip()]
+    if patient_ids:
+        alerts = read_alerts(patient_ids)
+        for alert in alerts:
+            missing = "、".join(LAB_NAMES.get(col, col) for col in alert.get('missing', []))
+            reported = "、".join(LAB_NAMES.get(col, col) for col in alert.get('newly_reported', []))
+            st.markdown(f"**{alert['patient_id']}**：{alert['old_tier']} → {alert['new_tier']} "
+                        f"({alert['prob']*100:.1f}%，{time.strftime('%m-%d %H:%M', time.localtime(alert['time']))})"
+                        + (f"  \n新报告：{reported}（此前按缺失值评分）" if reported else "")
+                        + (f"  \n依赖缺失值：{missing}" if missing else ""))
+        if not alerts:
+            st.caption("暂无提醒")
 
 # 标题
 st.markdown('<div class="main-header">🏥 NEC手术风险预测系统</div>', unsafe_allow_html=True)
@@ -154,12 +213,31 @@ st.markdown("---")
 if model_loaded:
     st.success("✅ 已加载真实XGBoost模型 (AUC=0.866)")
 else:
-    st.info("ℹ️ 当前使用模拟预测模式（演示用）")
+    fidelity = (scorecard or {}).get('fidelity')
+    if fidelity:
+        st.warning(f"⚠️ 当前使用蒸馏评分卡预测（加性分箱评分，XGBoost的近似）。{format_fidelity(scorecard)}，"
+                   f"约每 {1 / max(1 - fidelity['tier_agreement'], 1e-3):.0f} 例中有1例风险分层可能与模型不同")
+    else:
+        st.warning("⚠️ 当前使用蒸馏评分卡预测（加性分箱评分，XGBoost的近似），评分卡未记录一致性评估")
 
 # 侧边栏 - 患者信息输入
 st.sidebar.header("📋 患者临床信息")
 st.sidebar.markdown("请输入24小时内最差值")
 
+# 未检测的指标以缺失值（NaN）输入模型，由XGBoost的缺失值分支处理，不以默认值代替
+LAB_NAMES = {
+    'crp_mgL_24h': "CRP",
+    'il6_pgml_24h': "IL-6",
+    'fibrinogen_gL_24h': "纤维蛋白原",
+    'glucose_mmolL_24h': "血糖",
+    'hco3_24h': "碳酸氢根",
+    'creatinine_24h': "肌酐",
+    'hb_24h': "血红蛋白",
+    'plt_24h': "血小板",
+}
+missing_labs = st.sidebar.multiselect("未检测项目", options=list(LAB_NAMES), format_func=LAB_NAMES.get,
+                                      key="missing_labs", help="选中的指标按缺失处理，结果会标注依赖缺失值")
+
 # 创建两列布局
 col1, col2 = st.columns([2, 1])
 
@@ -167,40 +245,49 @@ with st.sidebar:
     # 炎症指标
     st.subheader("🔬 炎症指标")
     crp = st.number_input("CRP (mg/L)", min_value=0.0, max_value=500.0, value=50.0, step=5.0,
-                          help="C反应蛋白，正常值<10 mg/L")
+                          key="crp_mgL_24h", disabled="crp_mgL_24h" in missing_labs, help="C反应蛋白，正常值<10 mg/L")
     il6 = st.number_input("IL-6 (pg/mL)", min_value=0.0, max_value=5000.0, value=500.0, step=50.0,
-                          help="白介素-6，正常值<7 pg/mL")
+                          key="il6_pgml_24h", disabled="il6_pgml_24h" in missing_labs, help="白介素-6，正常值<7 pg/mL")
     fibrinogen = st.number_input("纤维蛋白原 (g/L)", min_value=0.0, max_value=15.0, value=3.0, step=0.5,
+                                 key="fibrinogen_gL_24h", disabled="fibrinogen_gL_24h" in missing_labs,
                                  help="正常值2-4 g/L")
     
     # 代谢指标
     st.subheader("💉 代谢指标")
     glucose = st.number_input("血糖 (mmol/L)", min_value=0.0, max_value=30.0, value=6.0, step=0.5,
+                              key="glucose_mmolL_24h", disabled="glucose_mmolL_24h" in missing_labs,
                               help="正常值3.9-6.1 mmol/L")
     hco3 = st.number_input("碳酸氢根 (mmol/L)", min_value=0.0, max_value=40.0, value=22.0, step=1.0,
-                           help="正常值22-28 mmol/L")
+                           key="hco3_24h", disabled="hco3_24h" in missing_labs, help="正常值22-28 mmol/L")
     creatinine = st.number_input("肌酐 (μmol/L)", min_value=0.0, max_value=300.0, value=50.0, step=5.0,
+                                 key="creatinine_24h", disabled="creatinine_24h" in missing_labs,
                                  help="新生儿正常值<80 μmol/L")
     
     # 血液学指标
     st.subheader("🩸 血液学指标")
     hb = st.number_input("血红蛋白 (g/L)", min_value=0.0, max_value=250.0, value=150.0, step=10.0,
-                        help="新生儿正常值145-225 g/L")
-    plt = st.number_input("血小板 (×10⁹/L)", min_value=0.0, max_value=800.0, value=200.0, step=10.0,
-                         help="新生儿正常值150-400 ×10⁹/L")
+                        key="hb_24h", disabled="hb_24h" in missing_labs, help="新生儿正常值145-225 g/L")
+    plt_count = st.number_input("血小板 (×10⁹/L)", min_value=0.0, max_value=800.0, value=200.0, step=10.0,
+                                key="plt_24h", disabled="plt_24h" in missing_labs, help="新生儿正常值150-400 ×10⁹/L")
     
     # 影像学和基本信息
     st.subheader("📸 影像学和基本信息")
     xray_loops = st.selectbox("X线固定肠襻", options=[0, 1], 
                               format_func=lambda x: "否" if x == 0 else "是",
+                              key="xray_fixed_loops",
                               help="腹部X线是否显示固定肠襻")
     bw_cat = st.selectbox("出生体重分类", 
                           options=["ELBW", "VLBW", "LBW", "NBW"],
                           index=1,
+                          key="bw_cat",
                           help="ELBW:<1000g, VLBW:1000-1499g, LBW:1500-2499g, NBW:≥2500g")
     
     # 预测按钮
     predict_button = st.button("🔮 预测手术风险", type="primary", use_container_width=True)
+    
+    # 风险等级变化提醒（由 nec_alerts.py 根据LIS新检验结果推送）
+    with st.expander("🔔 风险等级变化提醒"):
+        show_alerts()
 
 # 主界面
 with col1:
@@ -216,16 +303,18 @@ with col1:
             'hco3_24h': hco3,
             'creatinine_24h': creatinine,
             'hb_24h': hb,
-            'plt_24h': plt,
+            'plt_24h': plt_count,
             'xray_fixed_loops': xray_loops,
             'bw_cat': bw_cat
         }
+        input_data.update({lab: np.nan for lab in missing_labs})
         
         # 预测
         with st.spinner("正在分析患者数据..."):
             prob = predict_risk(input_data)
         
         if prob is not None:
+            record = evaluate_prediction(prob, input_data)
             # 获取风险分类
             category, risk_class, color = get_risk_category(prob)
             
@@ -238,6 +327,10 @@ with col1:
                 </div>
                 """, unsafe_allow_html=True)
             
+            if record.missing:
+                st.warning(f"⚠️ 本次预测依赖缺失值：{'、'.join(LAB_NAMES[lab] for lab in missing_labs)} 未检测，"
+                           "由模型的缺失值分支处理，可靠性降低，建议补充检验后重新评估")
+            
             st.markdown("---")
             
             # 特征贡献分析 - 使用英文标签
@@ -252,54 +345,62 @@ with col1:
                 'HCO3': (30 - hco3) / 30,
                 'Creatinine': creatinine / 150,
                 'Hemoglobin': (180 - hb) / 180,
-                'Platelet': (400 - plt) / 400,
+                'Platelet': (400 - plt_count) / 400,
                 'X-ray Loops': xray_loops,
                 'Birth Weight': 0.3 if bw_cat in ['ELBW', 'VLBW'] else 0.1
             }
             
-            # 归一化到0-1
-            features = {k: max(0, min(1, v)) for k, v in features.items()}
-            
-            # 绘制条形图
-            fig, ax = plt.subplots(figsize=(10, 6))
-            colors_list = [color if v > 0.5 else '#4caf50' for v in features.values()]
-            bars = ax.barh(list(features.keys()), list(features.values()), color=colors_list)
-            ax.set_xlabel('Contribution Score', fontsize=12)
-            ax.set_title('Feature Contributions to Surgical Risk', fontsize=14, fontweight='bold')
-            ax.set_xlim(0, 1)
+            # 归一化到0-1（未检测的指标不计贡献）
+            features = {(f"{k} (missing)" if np.isnan(v) else k): (0.0 if np.isnan(v) else max(0, min(1, v)))
+                        for k, v in features.items()}
             
-            # 添加数值标签
-            for i, (bar, value) in enumerate(zip(bars, features.values())):
-                ax.text(value + 0.02, i, f'{value:.2f}', va='center', fontsize=10)
-            
-            plt.tight_layout()
-            st.pyplot(fig)
+            show_contribution_chart(features, color)
             
             st.markdown("---")
             
             # 临床建议
             st.subheader("💡 个性化临床建议")
-            advice_list = get_clinical_advice(prob, input_data)
-            for advice in advice_list:
+            for advice in render_messages(record.advice, ADVICE_RULES):
                 st.markdown(f"- {advice}")
             
+            # 降级路径（反事实搜索）
+            if model_loaded and category != "低风险":
+                st.markdown("---")
+                st.subheader("🎯 降低风险等级的路径")
+                target_prob = risk_thresholds[1] if category == "高风险" else risk_thresholds[0]
+                cache_kind = f"counterfactual@{target_prob:.4f}"
+                result = prediction_cache.get(cache_kind, bundle_hash, input_data)
+                if result is None:
+                    result = search_counterfactuals(model, scaler, label_encoders, feature_cols,
+                                                    input_data, target_prob)
+                    prediction_cache.put(cache_kind, bundle_hash, input_data, result)
+                if result['suggestions']:
+                    st.markdown(f"调整以下可干预指标后，预测概率可降至 {target_prob*100:.0f}% 以下：")
+                    for suggestion in result['suggestions']:
+                        st.markdown(f"- {format_suggestion(suggestion)}")
+                else:
+                    st.info("在可干预指标（HCO₃、血糖、血红蛋白、血小板）的目标范围内未找到降级路径")
+                st.caption(f"已评估 {result['n_candidates']} 个候选组合，用时 {result['elapsed_ms']:.0f} ms")
+            
+            # 相似历史病例
+            if similar_index is not None:
+                st.markdown("---")
+                st.subheader("👥 相似历史病例")
+                if missing_labs:
+                    st.info("存在未检测指标，无法检索相似病例")
+                else:
+                    neighbours = find_similar_cases(similar_index, scaler, label_encoders, input_data, k=5)
+                    surgery_rate = neighbours['outcome'].mean()
+                    st.markdown(f"最相似的 {len(neighbours)} 例历史患者中，"
+                                f"**{surgery_rate*100:.0f}%** 在72小时内接受了手术")
+                    neighbours['outcome'] = neighbours['outcome'].map({1: "手术", 0: "未手术"})
+                    st.dataframe(neighbours, use_container_width=True, hide_index=True)
+            
             # 异常值警告
             st.markdown("---")
             st.subheader("⚠️ 异常指标警示")
             
-            warnings = []
-            if crp > 100:
-                warnings.append(f"🔴 **CRP严重升高** ({crp:.1f} mg/L > 100 mg/L)")
-            if il6 > 1000:
-                warnings.append(f"🔴 **IL-6严重升高** ({il6:.0f} pg/mL > 1000 pg/mL)")
-            if hco3 < 18:
-                warnings.append(f"🔴 **代谢性酸中毒** (HCO₃ {hco3:.1f} mmol/L < 18 mmol/L)")
-            if plt < 100:
-                warnings.append(f"🔴 **血小板减少** ({plt:.0f} ×10⁹/L < 100 ×10⁹/L)")
-            if creatinine > 100:
-                warnings.append(f"🟡 **肌酐升高** ({creatinine:.0f} μmol/L > 100 μmol/L)")
-            if xray_loops == 1:
-                warnings.append(f"🔴 **影像学异常** (X线显示固定肠襻)")
+            warnings = render_messages(record.warnings, WARNING_RULES, input_data)
             
             if warnings:
                 for warning in warnings:
@@ -310,7 +411,8 @@ with col1:
 with col2:
     st.header("ℹ️ 模型信息")
     
-    st.markdown("""
+    medium_pct, high_pct = (round(t * 100) for t in risk_thresholds)
+    st.markdown(f"""
     ### 模型性能
     - **模型**: XGBoost
     - **验证AUC**: 0.866
@@ -340,9 +442,9 @@ with col2:
     - X线固定肠襻
     
     ### 风险分层
-    - **高风险** (≥70%): 建议外科会诊
-    - **中风险** (40-69%): 加强监测
-    - **低风险** (<40%): 继续内科治疗
+    - **高风险** (≥{high_pct}%): 建议外科会诊
+    - **中风险** ({medium_pct}-{high_pct - 1}%): 加强监测
+    - **低风险** (<{medium_pct}%): 继续内科治疗
     
     ### 使用声明
     ⚠️ 本工具仅供临床辅助决策参考，
@@ -0,0 +1,346 @@
+"""
+NEC手术风险预测 - 批量查房报告
+对病区患者清单一次批量评分，为每位患者生成一页报告（概率、风险分层、特征贡献、临床建议），
+合并为一份HTML（可直接打印）和可选的PDF。HTML页面由缓存的模板直接拼接，
+PDF页面在多个工作进程中并行栅格化，每个进程只创建一次图形对象
+
+示例：
+    python nec_report.py census.csv --out rounds.html --pdf rounds.pdf --workers 4
+"""
+
+import argparse
+import html
+import io
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from nec_rules import ADVICE_RULES, WARNING_RULES, render_messages
+
+TIER_LABELS = [("低风险", "#4caf50"), ("中风险", "#ff9800"), ("高风险", "#f44336")]
+TIER_NAMES_EN = ["Low risk", "Medium risk", "High risk"]
+
+# 图表使用英文标签（与应用一致，PDF缺少中文字体时也能显示）
+FEATURE_NAMES_EN = {
+    'crp_mgL_24h': 'CRP',
+    'il6_pgml_24h': 'IL-6',
+    'fibrinogen_gL_24h': 'Fibrinogen',
+    'glucose_mmolL_24h': 'Glucose',
+    'hco3_24h': 'HCO3',
+    'creatinine_24h': 'Creatinine',
+    'hb_24h': 'Hemoglobin',
+    'plt_24h': 'Platelet',
+    'xray_fixed_loops': 'X-ray Loops',
+    'bw_cat': 'Birth Weight',
+}
+
+PAGE_CSS = """
+body { font-family: "Noto Sans CJK SC", "Microsoft YaHei", "PingFang SC", sans-serif; margin: 2rem; }
+h1 { color: #1f77b4; border-bottom: 3px solid #1f77b4; }
+table.summary { border-collapse: collapse; width: 100%; }
+table.summary td, table.summary th { border: 1px solid #ddd; padding: 0.3rem 0.6rem; }
+.patient { page-break-before: always; }
+.risk { padding: 1rem; border-left: 6px solid; background: #f8f9fa; margin: 1rem 0; }
+.risk h2, .risk h3 { margin: 0.2rem 0; }
+.missing { color: #b26a00; font-weight: bold; }
+.chart svg { max-width: 100%; height: auto; }
+@media print { body { margin: 0.5cm; } }
+"""
+
+PAGE_TEMPLATE = """
+<section class="patient">
+  <h2>患者 {patient_id}</h2>
+  <div class="risk" style="border-color: {color};">
+    <h3 style="color: {color};">手术风险: {tier}</h3>
+    <h2 style="color: {color};">{prob:.1f}%</h2>
+    <p>72小时内需要手术的概率</p>
+  </div>
+  {missing}
+  <h3>📈 特征贡献</h3>
+  <div class="chart">{chart}</div>
+  <h3>💡 临床建议</h3>
+  <ul>{advice}</ul>
+  <h3>⚠️ 异常指标</h3>
+  <ul>{warnings}</ul>
+</section>
+"""
+
+# 贡献图为内联SVG：坐标轴、网格等静态部分只生成一次，每页只填入条形几何
+CHART_WIDTH, CHART_LABEL_WIDTH, CHART_ROW = 640, 110, 26
+
+CHART_TEMPLATE = (
+    '<svg xmlns="http://www.w3.org/2000/svg" width="{width}" height="{height}" '
+    'font-family="sans-serif" font-size="12">{bars}'
+    '<line x1="{zero}" y1="0" x2="{zero}" y2="{axis_y}" stroke="black"/>'
+    '<text x="{mid}" y="{label_y}" text-anchor="middle" fill="#555">'
+    '对手术风险logit的贡献（红色升高风险，蓝色降低风险）</text></svg>'
+)
+
+BAR_TEMPLATE = (
+    '<text x="{text_x}" y="{text_y}" text-anchor="end">{name}</text>'
+    '<rect x="{x:.1f}" y="{y}" width="{w:.1f}" height="{h}" fill="{color}" fill-opacity="0.8"/>'
+    '<text x="{value_x:.1f}" y="{text_y}" text-anchor="{anchor}" fill="#333" font-size="11">{value:+.2f}</text>'
+)
+
+# 工作进程内缓存的PDF页面图表对象
+_worker = {}
+
+PDF_DPI = 150
+A4_POINTS = (595.28, 841.89)
+
+
+def render_chart(contributions, scale):
+    """按 scale（整批最大绝对贡献）绘制水平条形图SVG，各页比例尺一致"""
+    plot_width = CHART_WIDTH - CHART_LABEL_WIDTH - 60
+    zero = CHART_LABEL_WIDTH + 30 + plot_width / 2
+    unit = plot_width / 2 / scale
+    bars = []
+    for i, (name, value) in enumerate(contributions.items()):
+        y = 8 + i * CHART_ROW
+        w = abs(value) * unit
+        x = zero if value >= 0 else zero - w
+        bars.append(BAR_TEMPLATE.format(
+            text_x=CHART_LABEL_WIDTH, text_y=y + 14, name=html.escape(name),
+            x=x, y=y, w=w, h=CHART_ROW - 8, color='#d32f2f' if value > 0 else '#1976d2',
+            value_x=x + w + 4 if value >= 0 else x - 4, anchor='start' if value >= 0 else 'end',
+            value=value,
+        ))
+    axis_y = 8 + len(contributions) * CHART_ROW
+    return CHART_TEMPLATE.format(
+        width=CHART_WIDTH, height=axis_y + 28, bars=''.join(bars), zero=zero,
+        axis_y=axis_y, mid=zero, label_y=axis_y + 20,
+    )
+
+
+def _markdown_to_html(text):
+    return re.sub(r'\*\*(.+?)\*\*', r'<strong>\1</strong>', html.escape(text))
+
+
+def render_page(page, scale):
+    """渲染单个患者的HTML页面片段"""
+    tier, color = TIER_LABELS[page['tier']]
+    fragment = PAGE_TEMPLATE.format(
+        patient_id=html.escape(str(page['patient_id'])),
+        color=color,
+        tier=tier,
+        prob=page['prob'] * 100,
+        chart=render_chart(page['contributions'], scale),
+        missing=f"<p class='missing'>⚠️ 依赖缺失值：{html.escape(', '.join(page['missing']))} 未检测</p>"
+        if page['missing'] else '',
+        advice=''.join(f"<li>{_markdown_to_html(a)}</li>" for a in page['advice']),
+        warnings=''.join(f"<li>{_markdown_to_html(w)}</li>" for w in page['warnings']) or
+        "<li>✅ 所有指标均在可接受范围内</li>",
+    )
+    return fragment
+
+
+def _init_worker():
+    """工作进程初始化：创建一次A4页面及全部图形元素，之后每页只更新数据"""
+    import warnings
+
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    cjk_font = _find_cjk_font()
+    plt.rcParams['font.family'] = [cjk_font, 'DejaVu Sans'] if cjk_font else ['DejaVu Sans']
+    plt.rcParams['axes.unicode_minus'] = False
+    # 缺少中文字体时的逐字形告警已在启动时提示过一次
+    warnings.filterwarnings('ignore', message='Glyph .* missing')
+
+    fig = plt.figure(figsize=(8.27, 11.69), dpi=100)
+    title = fig.text(0.08, 0.94, '', fontsize=18, fontweight='bold')
+    risk = fig.text(0.08, 0.89, '', fontsize=16)
+    missing = fig.text(0.08, 0.86, '', fontsize=11, color='#b26a00')
+    ax = fig.add_axes([0.22, 0.40, 0.7, 0.42])
+    n = len(FEATURE_NAMES_EN)
+    bars = ax.barh(range(n), [0] * n, alpha=0.8)
+    ax.set_ylim(n - 0.5, -0.5)
+    ax.set_yticks([])
+    ax.axvline(0, color='black', linewidth=1)
+    ax.set_xlabel('Contribution to log-odds of surgery', fontsize=11)
+    names = [ax.text(0, i, '', ha='right', va='center', fontsize=10,
+                     transform=ax.get_yaxis_transform()) for i in range(n)]
+    lines = [fig.text(0.08, 0.33 - i * 0.022, '', fontsize=9) for i in range(16)]
+    _worker.update(fig=fig, ax=ax, title=title, risk=risk, missing=missing, bars=bars, names=names, lines=lines, scale=None)
+
+
+def _render_pdf_page(page, scale):
+    """PDF页面（A4）：复用工作进程内的图形元素，只更新文字和条形长度，返回JPEG字节"""
+    if not _worker:
+        _init_worker()
+    w = _worker
+    color = TIER_LABELS[page['tier']][1]
+    w['title'].set_text(f"Patient {page['patient_id']}")
+    w['risk'].set_text(f"{page['prob']*100:.1f}%  {TIER_NAMES_EN[page['tier']]}")
+    w['risk'].set_color(color)
+    w['missing'].set_text(f"Missing inputs: {', '.join(page['missing'])}" if page['missing'] else '')
+    if w['scale'] != scale:
+        w['ax'].set_xlim(-scale * 1.05, scale * 1.05)
+        w['scale'] = scale
+    for bar, label, (name, value) in zip(w['bars'], w['names'], page['contributions'].items()):
+        bar.set_width(value)
+        bar.set_color('#d32f2f' if value > 0 else '#1976d2')
+        label.set_text(name + '  ')
+        label.set_x(-0.01)
+    text = [re.sub(r'\*\*', '', line) for line in page['advice'] + page['warnings']]
+    for i, artist in enumerate(w['lines']):
+        artist.set_text(text[i] if i < len(text) else '')
+    buf = io.BytesIO()
+    w['fig'].savefig(buf, format='jpeg', dpi=PDF_DPI, pil_kwargs={'quality': 85})
+    return buf.getvalue()
+
+
+def _find_cjk_font():
+    """查找系统中的中文字体（PDF中的中文建议文字需要）"""
+    from matplotlib import font_manager
+
+    for font in font_manager.fontManager.ttflist:
+        if re.search(r'CJK|Hei|YaHei|WenQuanYi|Song|Noto Sans SC', font.name):
+            return font.name
+    return None
+
+
+def build_pages(census, bundle, thresholds=None):
+    """批量评分并组装每位患者的页面数据"""
+    import xgboost as xgb
+
+    from nec_inference import encode_features, missing_features, score_batch
+
+    # 缺失值不插补，由XGBoost默认分支处理；结果中记录每行缺失位掩码
+    results = score_batch(bundle.model, bundle.scaler, bundle.label_encoders, bundle.feature_cols,
+                          census, thresholds)
+    # 每个特征对logit的贡献（TreeSHAP），一次调用完成整批
+    X = encode_features(census, bundle.scaler, bundle.label_encoders, bundle.feature_cols)
+    dmatrix = xgb.DMatrix(X, feature_names=list(bundle.feature_cols))
+    contribs = bundle.model.get_booster().predict(dmatrix, pred_contribs=True)[:, :-1]
+
+    names = [FEATURE_NAMES_EN.get(c, c) for c in bundle.feature_cols]
+    patient_ids = census['patient_id'] if 'patient_id' in census else census.index
+    records = census.to_dict('records')
+    pages = []
+    for i, patient_id in enumerate(patient_ids):
+        order = np.argsort(-np.abs(contribs[i]))
+        pages.append({
+            'patient_id': patient_id,
+            'prob': float(results['prob'][i]),
+            'tier': int(results['tier'][i]),
+            'contributions': {names[j]: float(contribs[i, j]) for j in order},
+            'missing': [FEATURE_NAMES_EN.get(c, c) for c in missing_features(results['missing'][i], bundle.feature_cols)],
+            'advice': render_messages(results['advice'][i], ADVICE_RULES),
+            'warnings': render_messages(results['warnings'][i], WARNING_RULES, records[i]),
+        })
+    return pages
+
+
+def generate_report(pages, html_path, pdf_path=None, workers=None):
+    """
+    渲染所有页面并写出HTML（和PDF）
+
+    HTML页面由缓存的模板直接拼接，在主进程中完成；PDF页面需要栅格化，
+    分发到 workers 个工作进程并行渲染，按顺序逐页追加写入。
+    """
+    ordered = sorted(pages, key=lambda p: -p['prob'])
+    scale = max((max(abs(v) for v in p['contributions'].values()) for p in ordered), default=1.0) or 1.0
+
+    summary_rows = ''.join(
+        f"<tr><td>{html.escape(str(p['patient_id']))}</td><td>{p['prob']*100:.1f}%</td>"
+        f"<td style='color:{TIER_LABELS[p['tier']][1]}'>{TIER_LABELS[p['tier']][0]}</td>"
+        f"<td>{html.escape(', '.join(p['missing']))}</td></tr>"
+        for p in ordered
+    )
+    with open(html_path, 'w', encoding='utf-8') as out:
+        out.write(f"<!DOCTYPE html><html><head><meta charset='utf-8'><title>NEC手术风险查房报告</title>"
+                  f"<style>{PAGE_CSS}</style></head><body>"
+                  f"<h1>🏥 NEC手术风险查房报告</h1>"
+                  f"<p>生成时间: {time.strftime('%Y-%m-%d %H:%M')} | 患者数: {len(ordered)}</p>"
+                  f"<table class='summary'><tr><th>患者</th><th>手术概率</th><th>风险分层</th><th>缺失检验</th></tr>"
+                  f"{summary_rows}</table>")
+        for page in ordered:
+            out.write(render_page(page, scale))
+        out.write("<p style='color:#666'>⚠️ 仅供医疗专业人员使用 | 不可替代临床判断</p></body></html>")
+
+    if pdf_path is None or not ordered:
+        return
+    workers = workers or os.cpu_count() or 1
+    chunksize = max(1, len(ordered) // (workers * 4))
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        write_pdf(pdf_path, pool.map(_render_pdf_page, ordered, [scale] * len(ordered), chunksize=chunksize))
+
+
+def write_pdf(path, jpeg_pages):
+    """
+    将JPEG页面流式写成PDF（每页一张A4整页图像）
+
+    页面按到达顺序直接写入文件，内存中只保留当前页；图像数据原样嵌入（DCTDecode），无需重新编码。
+    """
+    from PIL import Image
+
+    offsets = []
+    page_ids = []
+
+    with open(path, 'wb') as f:
+        def obj(body, stream=None):
+            offsets.append(f.tell())
+            f.write(f"{len(offsets)} 0 obj\n".encode('ascii') + body)
+            if stream is not None:
+                f.write(b"\nstream\n" + stream + b"\nendstream")
+            f.write(b"\nendobj\n")
+            return len(offsets)
+
+        f.write(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        offsets.append(None)  # 1号对象（页面树）最后写入
+        width, height = A4_POINTS
+        for jpeg in jpeg_pages:
+            w, h = Image.open(io.BytesIO(jpeg)).size
+            image = obj(f"<< /Type /XObject /Subtype /Image /Width {w} /Height {h} /ColorSpace /DeviceRGB "
+                        f"/BitsPerComponent 8 /Filter /DCTDecode /Length {len(jpeg)} >>".encode('ascii'), jpeg)
+            content = f"q {width} 0 0 {height} 0 0 cm /Im0 Do Q".encode('ascii')
+            content_id = obj(f"<< /Length {len(content)} >>".encode('ascii'), content)
+            page_ids.append(obj(
+                f"<< /Type /Page /Parent 1 0 R /MediaBox [0 0 {width} {height}] "
+                f"/Resources << /XObject << /Im0 {image} 0 R >> >> /Contents {content_id} 0 R >>".encode('ascii')))
+
+        offsets[0] = f.tell()
+        kids = ' '.join(f"{i} 0 R" for i in page_ids)
+        f.write(f"1 0 obj\n<< /Type /Pages /Kids [{kids}] /Count {len(page_ids)} >>\nendobj\n".encode('ascii'))
+        catalog = obj(b"<< /Type /Catalog /Pages 1 0 R >>")
+
+        xref = f.tell()
+        f.write(f"xref\n0 {len(offsets) + 1}\n0000000000 65535 f \n".encode('ascii'))
+        f.write(''.join(f"{offset:010d} 00000 n \n" for offset in offsets).encode('ascii'))
+        f.write(f"trailer\n<< /Size {len(offsets) + 1} /Root {catalog} 0 R >>\n"
+                f"startxref\n{xref}\n%%EOF\n".encode('ascii'))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="批量生成查房风险报告")
+    parser.add_argument('census', help="病区患者清单CSV（patient_id + 全部特征列）")
+    parser.add_argument('--site', default='default', help="院区ID")
+    parser.add_argument('--out', default='rounds_report.html', help="HTML输出路径")
+    parser.add_argument('--pdf', default=None, help="PDF输出路径（可选）")
+    parser.add_argument('--workers', type=int, default=None, help="渲染进程数，默认为CPU核数")
+    args = parser.parse_args()
+
+    from nec_model_manager import ModelManager
+    from nec_thresholds import THRESHOLDS_FILE, load_thresholds
+
+    start = time.perf_counter()
+    manager = ModelManager()
+    bundle = manager.get(args.site)
+    thresholds = load_thresholds(manager.artifact_path(args.site, THRESHOLDS_FILE))
+    census = pd.read_csv(args.census)
+    pages = build_pages(census, bundle, thresholds)
+    if args.pdf and _find_cjk_font() is None:
+        print("⚠️ 未找到中文字体，PDF中的中文建议可能无法显示，请使用HTML报告打印")
+    generate_report(pages, args.out, args.pdf, args.workers)
+    print(f"已生成 {len(pages)} 位患者的报告 -> {args.out}"
+          f"{' / ' + args.pdf if args.pdf else ''}（用时 {time.perf_counter() - start:.1f} 秒）")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+"""
+NEC手术风险预测 - 临床规则引擎
+声明式规则表（特征、运算符、阈值、严重程度、消息），对整批数据以NumPy布尔掩码求值，
+每行结果为紧凑的整数位集（第i位对应规则表第i条），消息仅在渲染时生成
+"""
+
+import numpy as np
+
+# 严重程度
+SEVERITY_INFO = 0
+SEVERITY_WARNING = 1
+SEVERITY_CRITICAL = 2
+
+OPERATORS = {
+    '>': np.greater,
+    '>=': np.greater_equal,
+    '<': np.less,
+    '<=': np.less_equal,
+    '==': np.equal,
+}
+
+# 风险分层代码（risk_tier列）：0=低风险，1=中风险，2=高风险
+TIER_LOW, TIER_MEDIUM, TIER_HIGH = 0, 1, 2
+
+# 默认分层阈值 (中风险, 高风险)，院区可用 nec_thresholds.py 重新选择
+DEFAULT_RISK_THRESHOLDS = (0.4, 0.7)
+
+# 个性化临床建议
+# (特征, 运算符, 阈值, 严重程度, 消息)
+ADVICE_RULES = [
+    ('risk_tier', '==', TIER_HIGH, SEVERITY_CRITICAL, "🚨 **立即建议**：患者需要外科会诊评估手术指征"),
+    ('risk_tier', '==', TIER_HIGH, SEVERITY_CRITICAL, "📊 **监测重点**：密切监测生命体征和腹部体征变化"),
+    ('risk_tier', '==', TIER_HIGH, SEVERITY_CRITICAL, "💊 **治疗建议**：确保充分的液体复苏和抗生素治疗"),
+    ('risk_tier', '==', TIER_MEDIUM, SEVERITY_WARNING, "⚠️ **建议**：加强监测，考虑外科会诊"),
+    ('risk_tier', '==', TIER_MEDIUM, SEVERITY_WARNING, "📊 **监测频率**：每2-4小时评估一次腹部体征"),
+    ('risk_tier', '==', TIER_MEDIUM, SEVERITY_WARNING, "💊 **治疗优化**：优化内科保守治疗方案"),
+    ('risk_tier', '==', TIER_LOW, SEVERITY_INFO, "✅ **当前状态**：继续内科保守治疗"),
+    ('risk_tier', '==', TIER_LOW, SEVERITY_INFO, "📊 **常规监测**：按标准频率监测生命体征"),
+    ('risk_tier', '==', TIER_LOW, SEVERITY_INFO, "💊 **治疗方案**：维持当前治疗方案"),
+    ('crp_mgL_24h', '>', 100, SEVERITY_WARNING, "⚕️ **炎症指标**：CRP显著升高，注意感染控制"),
+    ('il6_pgml_24h', '>', 1000, SEVERITY_WARNING, "⚕️ **炎症因子**：IL-6显著升高，提示强烈炎症反应"),
+    ('hco3_24h', '<', 18, SEVERITY_WARNING, "⚕️ **代谢状态**：代谢性酸中毒，注意纠正"),
+    ('plt_24h', '<', 100, SEVERITY_WARNING, "⚕️ **凝血功能**：血小板减少，警惕DIC"),
+    ('xray_fixed_loops', '==', 1, SEVERITY_WARNING, "⚕️ **影像学**：存在固定肠襻，需密切观察"),
+]
+
+# 异常指标警示（消息中的 {特征名} 在渲染时用输入值填充）
+WARNING_RULES = [
+    ('crp_mgL_24h', '>', 100, SEVERITY_CRITICAL, "🔴 **CRP严重升高** ({crp_mgL_24h:.1f} mg/L > 100 mg/L)"),
+    ('il6_pgml_24h', '>', 1000, SEVERITY_CRITICAL, "🔴 **IL-6严重升高** ({il6_pgml_24h:.0f} pg/mL > 1000 pg/mL)"),
+    ('hco3_24h', '<', 18, SEVERITY_CRITICAL, "🔴 **代谢性酸中毒** (HCO₃ {hco3_24h:.1f} mmol/L < 18 mmol/L)"),
+    ('plt_24h', '<', 100, SEVERITY_CRITICAL, "🔴 **血小板减少** ({plt_24h:.0f} ×10⁹/L < 100 ×10⁹/L)"),
+    ('creatinine_24h', '>', 100, SEVERITY_WARNING, "🟡 **肌酐升高** ({creatinine_24h:.0f} μmol/L > 100 μmol/L)"),
+    ('xray_fixed_loops', '==', 1, SEVERITY_CRITICAL, "🔴 **影像学异常** (X线显示固定肠襻)"),
+]
+
+
+def risk_tier_codes(probs, thresholds=DEFAULT_RISK_THRESHOLDS):
+    """将预测概率批量转换为风险分层代码"""
+    return np.digitize(np.asarray(probs, dtype=np.float64), thresholds).astype(np.int8)
+
+
+def evaluate_rules(data, rules):
+    """
+    对整批数据求值规则表，返回每行一个 uint32 位集
+
+    data 为 DataFrame 或 {特征: 数组} 字典；缺失值（NaN）不触发任何规则，
+    数据中不存在的特征对应的规则跳过。
+    """
+    if len(rules) > 32:
+        raise ValueError("规则表最多支持32条规则")
+
+    n_rows = len(next(iter(data.values()))) if isinstance(data, dict) else len(data)
+    codes = np.zeros(n_rows, dtype=np.uint32)
+    for bit, (feature, op, threshold, _, _) in enumerate(rules):
+        if feature not in data:
+            continue
+        values = np.asarray(data[feature], dtype=np.float64)
+        mask = OPERATORS[op](values, threshold)
+        codes |= mask.astype(np.uint32) << np.uint32(bit)
+    return codes
+
+
+def render_messages(code, rules, values=None):
+    """渲染单行位集对应的消息（values 用于填充消息中的数值）"""
+    code = int(code)
+    messages = []
+    for bit, (_, _, _, _, message) in enumerate(rules):
+        if code >> bit & 1:
+            messages.append(message.format(**values) if values else message)
+    return messages
+
@@ -0,0 +1,283 @@
+"""
+NEC手术风险预测 - 蒸馏评分卡
+将XGBoost模型蒸馏为加性评分卡（每个特征分箱赋分），保存为 scorecard.json。
+评分只依赖Python标准库，作为XGBoost/sklearn不可用时的回退，也可打印作床旁工具。
+每个特征另有"未检测"分值，模仿XGBoost对缺失值的默认分支
+
+蒸馏评分卡：
+    python nec_scorecard.py --cohort cohort.csv --out scorecard.json
+    python nec_scorecard.py --print            # 打印床旁评分表
+"""
+
+import argparse
+import json
+import math
+import os
+from bisect import bisect_right
+
+SCORECARD_FILE = 'scorecard.json'
+
+# 每分对应的logit增量：总分 × POINT_SCALE + 截距 = logit
+POINT_SCALE = 0.1
+
+CATEGORICAL_FEATURES = {
+    'xray_fixed_loops': [0, 1],
+    'bw_cat': ['ELBW', 'VLBW', 'LBW', 'NBW'],
+}
+
+FEATURE_LABELS = {
+    'crp_mgL_24h': 'CRP (mg/L)',
+    'il6_pgml_24h': 'IL-6 (pg/mL)',
+    'fibrinogen_gL_24h': '纤维蛋白原 (g/L)',
+    'glucose_mmolL_24h': '血糖 (mmol/L)',
+    'hco3_24h': '碳酸氢根 (mmol/L)',
+    'creatinine_24h': '肌酐 (μmol/L)',
+    'hb_24h': '血红蛋白 (g/L)',
+    'plt_24h': '血小板 (×10⁹/L)',
+    'xray_fixed_loops': 'X线固定肠襻',
+    'bw_cat': '出生体重分类',
+}
+
+
+# ============================================================================
+# 评分（仅标准库）
+# ============================================================================
+
+def _category_key(value):
+    """分类取值统一为字符串（数值型如 1.0 记为 '1'）"""
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return str(int(value))
+    return str(value)
+
+
+def _is_missing(value):
+    return value is None or (isinstance(value, float) and math.isnan(value))
+
+
+def _max_points(table):
+    points = table['points']
+    return max(max(points.values() if isinstance(points, dict) else points), table.get('missing', 0))
+
+
+def load_scorecard(path=SCORECARD_FILE):
+    """读取评分卡"""
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def feature_points(card, input_data):
+    """每个特征的得分（缺失值取该特征的"未检测"分值）"""
+    points = {}
+    for feature, table in card['features'].items():
+        value = input_data.get(feature)
+        if _is_missing(value):
+            points[feature] = table.get('missing', 0)
+        elif 'edges' in table:
+            points[feature] = table['points'][bisect_right(table['edges'], float(value))]
+        else:
+            points[feature] = table['points'][_category_key(value)]
+    return points
+
+
+def score_to_prob(card, total_points):
+    """总分转换为手术概率"""
+    logit = card['intercept'] + total_points * card['point_scale']
+    return 1.0 / (1.0 + math.exp(-logit))
+
+
+def predict_proba(card, input_data):
+    """用评分卡预测手术概率，常数时间"""
+    return score_to_prob(card, sum(feature_points(card, input_data).values()))
+
+
+def format_scorecard(card):
+    """格式化为可打印的床旁评分表"""
+    lines = ["NEC手术风险评分卡（XGBoost蒸馏）", "=" * 40]
+    for feature, table in card['features'].items():
+        lines.append(FEATURE_LABELS.get(feature, feature))
+        if 'edges' in table:
+            bounds = [None] + table['edges'] + [None]
+            for lo, hi, pts in zip(bounds[:-1], bounds[1:], table['points']):
+                if lo is None:
+                    label = f"< {hi:g}"
+                elif hi is None:
+                    label = f"≥ {lo:g}"
+                else:
+                    label = f"{lo:g} – <{hi:g}"
+                lines.append(f"    {label:<20}{pts:>4} 分")
+        else:
+            for category, pts in table['points'].items():
+                label = {'0': '否', '1': '是'}.get(category, category)
+                lines.append(f"    {label:<20}{pts:>4} 分")
+        if 'missing' in table:
+            lines.append(f"    {'未检测':<20}{table['missing']:>4} 分")
+    lines.append("-" * 40)
+    lines.append("总分 → 72小时内手术概率")
+    max_total = sum(_max_points(table) for table in card['features'].values())
+    step = max(1, max_total // 12)
+    for total in range(0, max_total + step, step):
+        lines.append(f"    {total:>4} 分    {score_to_prob(card, total)*100:5.1f}%")
+    if card.get('fidelity'):
+        lines.append("-" * 40)
+        lines.append(format_fidelity(card))
+    return "\n".join(lines)
+
+
+# 一致性评估数据来源
+FIDELITY_SOURCES = {'cohort': "历史队列", 'synthetic': "按scaler统计量合成的样本"}
+
+
+def format_fidelity(card):
+    """评分卡与XGBoost的一致性摘要（分层一致率、概率误差和评估数据来源），无评估结果时返回空串"""
+    fidelity = card.get('fidelity')
+    if not fidelity:
+        return ""
+    source = FIDELITY_SOURCES.get(fidelity.get('source'), fidelity.get('source', '未知'))
+    return (f"与XGBoost一致性: 风险分层一致率 {fidelity['tier_agreement']*100:.1f}%，"
+            f"概率平均绝对误差 {fidelity['prob_mae']:.3f}（最大 {fidelity['prob_max_error']:.2f}），"
+            f"评估数据 {fidelity['n_eval']} 例{source}")
+
+
+# ============================================================================
+# 蒸馏（需要完整的numpy/pandas/joblib/xgboost环境）
+# ============================================================================
+
+def sample_inputs(scaler, label_encoders, feature_cols, n_samples, seed=0):
+    """
+    按训练集均值和标准差（取自scaler）生成合成输入，用于无队列数据时蒸馏
+
+    连续变量用同均值、同标准差的对数正态分布（实验室指标均为正且右偏）。
+    """
+    import numpy as np
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    data = {}
+    for i, col in enumerate(feature_cols):
+        if col == 'xray_fixed_loops':
+            data[col] = rng.binomial(1, scaler.mean_[i], n_samples)
+        elif col in label_encoders:
+            data[col] = rng.choice(label_encoders[col].classes_, n_samples)
+        else:
+            sigma2 = np.log1p((scaler.scale_[i] / scaler.mean_[i]) ** 2)
+            mu = np.log(scaler.mean_[i]) - sigma2 / 2
+            data[col] = rng.lognormal(mu, np.sqrt(sigma2), n_samples)
+    return pd.DataFrame(data)
+
+
+def distill(model, scaler, label_encoders, feature_cols, cohort=None, n_bins=8,
+            n_samples=20000, ridge=1e-3, missing_rate=0.1, seed=0):
+    """
+    拟合加性评分卡以模仿XGBoost输出
+
+    对XGBoost的logit做分箱指示变量的岭回归，系数换算为整数分（每个特征最低为0分），
+    返回评分卡字典（含留出集上的一致性指标）。每个特征随机置空 missing_rate 比例的取值，
+    使"未检测"分箱学到XGBoost缺失值默认分支的效果。
+    """
+    import numpy as np
+
+    from nec_inference import encode_features
+    from nec_rules import risk_tier_codes
+
+    df = cohort[feature_cols].copy() if cohort is not None else \
+        sample_inputs(scaler, label_encoders, feature_cols, n_samples, seed)
+    mask_rng = np.random.default_rng(seed + 1)
+    for col in feature_cols:
+        df[col] = df[col].where(mask_rng.random(len(df)) >= missing_rate)
+    margin = model.predict(encode_features(df, scaler, label_encoders, feature_cols),
+                           output_margin=True).astype(np.float64)
+
+    # 分箱指示矩阵
+    columns, tables = [], {}
+    for col in feature_cols:
+        if col in CATEGORICAL_FEATURES:
+            categories = CATEGORICAL_FEATURES[col]
+            values = df[col].map(_category_key, na_action='ignore').to_numpy()
+            columns += [values == str(c) for c in categories]
+            tables[col] = {'categories': [str(c) for c in categories]}
+        else:
+            values = df[col].to_numpy(dtype=np.float64)
+            edges = np.unique(np.round(np.nanquantile(values, np.linspace(0, 1, n_bins + 1)[1:-1]), 1))
+            bins = np.searchsorted(edges, values, side='right')
+            columns += [(bins == b) & ~np.isnan(values) for b in range(len(edges) + 1)]
+            tables[col] = {'edges': edges.tolist()}
+        columns.append(df[col].isna().to_numpy())
+    X = np.column_stack(columns).astype(np.float64)
+
+    # 留出20%评估一致性
+    rng = np.random.default_rng(seed)
+    test = rng.random(len(df)) < 0.2
+    A = np.column_stack([np.ones(len(X)), X])
+    reg = ridge * np.eye(A.shape[1])
+    reg[0, 0] = 0
+    coef = np.linalg.solve(A[~test].T @ A[~test] + reg, A[~test].T @ margin[~test])
+
+    # 系数换算为整数分，每个特征最低分平移为0
+    intercept = coef[0]
+    offset = 1
+    card = {'point_scale': POINT_SCALE, 'features': {}}
+    for col in feature_cols:
+        n = (len(tables[col].get('categories', [])) or len(tables[col]['edges']) + 1) + 1
+        weights = coef[offset:offset + n]
+        offset += n
+        intercept += weights.min()
+        points = np.round((weights - weights.min()) / POINT_SCALE).astype(int).tolist()
+        missing_points = points.pop()
+        if 'categories' in tables[col]:
+            card['features'][col] = {'points': dict(zip(tables[col]['categories'], points))}
+        else:
+            card['features'][col] = {'edges': tables[col]['edges'], 'points': points}
+        card['features'][col]['missing'] = missing_points
+    card['intercept'] = float(intercept)
+
+    # 一致性：以整数分评分卡与XGBoost比较
+    records = df[test].to_dict('records')
+    card_prob = np.array([predict_proba(card, r) for r in records])
+    xgb_prob = 1.0 / (1.0 + np.exp(-margin[test]))
+    card['fidelity'] = {
+        'n_eval': int(test.sum()),
+        'prob_mae': float(np.mean(np.abs(card_prob - xgb_prob))),
+        'prob_max_error': float(np.max(np.abs(card_prob - xgb_prob))),
+        'prob_correlation': float(np.corrcoef(card_prob, xgb_prob)[0, 1]),
+        'tier_agreement': float(np.mean(risk_tier_codes(card_prob) == risk_tier_codes(xgb_prob))),
+        'source': 'cohort' if cohort is not None else 'synthetic',
+    }
+    return card
+
+
+def main():
+    parser = argparse.ArgumentParser(description="蒸馏XGBoost为加性评分卡")
+    parser.add_argument('--cohort', default=None, help="用于蒸馏的队列CSV，缺省时按scaler统计量合成")
+    parser.add_argument('--site', default='default', help="院区ID，使用该院区的模型包（缺失文件回退到根目录）")
+    parser.add_argument('--out', default=None, help="评分卡输出路径，默认写入院区模型包目录")
+    parser.add_argument('--bins', type=int, default=8, help="连续变量分箱数")
+    parser.add_argument('--print', dest='print_only', action='store_true', help="仅打印已有评分卡")
+    args = parser.parse_args()
+
+    from nec_model_manager import ModelManager
+
+    manager = ModelManager()
+    try:
+        out = args.out or os.path.join(manager.site_dir(args.site), SCORECARD_FILE)
+    except KeyError as e:
+        parser.error(e.args[0])
+
+    if args.print_only:
+        print(format_scorecard(load_scorecard(args.out or manager.artifact_path(args.site, SCORECARD_FILE))))
+        return
+
+    import pandas as pd
+
+    bundle = manager.get(args.site)
+    cohort = pd.read_csv(args.cohort) if args.cohort else None
+
+    card = distill(bundle.model, bundle.scaler, bundle.label_encoders, bundle.feature_cols, cohort,
+                   n_bins=args.bins)
+    with open(out, 'w', encoding='utf-8') as f:
+        json.dump(card, f, ensure_ascii=False, indent=2)
+    print(format_scorecard(card))
+    print(json.dumps(card['fidelity'], indent=2))
+
+
+if __name__ == "__main__":
+    main()
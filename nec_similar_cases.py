@@ -0,0 +1,81 @@
+"""
+NEC手术风险预测 - 相似历史病例检索
+在 scaler.pkl 的标准化特征空间中建立KD树索引（含编码后的 bw_cat 和 xray_fixed_loops），
+索引随模型包保存为 similar_cases.pkl，只保留去标识化的特征值和结局
+
+构建索引：
+    python nec_similar_cases.py cohort.csv --outcome surgery_72h --site site_a
+"""
+
+import argparse
+import os
+
+import joblib
+import numpy as np
+import pandas as pd
+
+from nec_inference import encode_features
+
+INDEX_FILE = 'similar_cases.pkl'
+
+
+def build_index(cohort, scaler, label_encoders, feature_cols, outcome_col='surgery_72h', scaler_hash=None):
+    """
+    从历史队列构建索引（编码与标准化与线上预测一致）
+
+    返回普通字典，便于随模型包pickle保存：
+    KD树、取整后的特征值（分类变量为编码值）、结局和特征列表，不含任何患者标识；
+    scaler_hash 记录构建所用scaler的文件哈希，加载时与院区scaler不一致的索引不会使用
+    """
+    from sklearn.neighbors import KDTree
+
+    cohort = cohort.dropna(subset=list(feature_cols) + [outcome_col])
+    X_scaled = encode_features(cohort, scaler, label_encoders, feature_cols)
+    return {
+        'tree': KDTree(X_scaled, leaf_size=40),
+        'features': np.round(scaler.inverse_transform(X_scaled), 1).astype(np.float32),
+        'outcomes': cohort[outcome_col].to_numpy(dtype=np.int8),
+        'feature_cols': list(feature_cols),
+        'scaler_hash': scaler_hash,
+    }
+
+
+def find_similar_cases(index, scaler, label_encoders, input_data, k=5):
+    """查找与当前患者最相似的历史病例，返回含距离和结局的DataFrame"""
+    x = encode_features(pd.DataFrame([input_data]), scaler, label_encoders, index['feature_cols'])
+    dist, ind = index['tree'].query(x, k=min(k, len(index['outcomes'])))
+    neighbours = pd.DataFrame(index['features'][ind[0]].astype(np.float64).round(1),
+                              columns=index['feature_cols'])
+    if 'bw_cat' in label_encoders and 'bw_cat' in neighbours:
+        neighbours['bw_cat'] = label_encoders['bw_cat'].inverse_transform(
+            neighbours['bw_cat'].round().astype(int))
+    neighbours.insert(0, 'distance', np.round(dist[0], 2))
+    neighbours['outcome'] = index['outcomes'][ind[0]]
+    return neighbours
+
+
+def main():
+    parser = argparse.ArgumentParser(description="构建相似历史病例索引")
+    parser.add_argument('cohort', help="历史队列CSV，需包含全部特征列和结局列")
+    parser.add_argument('--outcome', default='surgery_72h', help="结局列名（0/1）")
+    parser.add_argument('--site', default='default', help="院区ID，使用该院区的scaler和编码器（缺失文件回退到根目录）")
+    parser.add_argument('--out', default=None, help="输出路径，默认写入院区模型包目录")
+    args = parser.parse_args()
+
+    from nec_model_manager import ModelManager
+
+    manager = ModelManager()
+    try:
+        bundle = manager.get(args.site)
+    except KeyError as e:
+        parser.error(e.args[0])
+    cohort = pd.read_csv(args.cohort)
+    index = build_index(cohort, bundle.scaler, bundle.label_encoders, bundle.feature_cols, args.outcome,
+                        scaler_hash=bundle.artifact_hashes['scaler'])
+    out = args.out or os.path.join(manager.site_dir(args.site), INDEX_FILE)
+    joblib.dump(index, out)
+    print(f"已索引 {len(index['outcomes'])} 例患者 -> {out}")
+
+
+if __name__ == "__main__":
+    main()
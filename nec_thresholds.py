@@ -0,0 +1,164 @@
+"""
+NEC手术风险预测 - 风险分层阈值优化与决策曲线分析
+对带结局的队列一次排序、累计计数即可得到所有阈值下的灵敏度/特异度/PPV/NPV和净获益，
+无需逐阈值重新评分；选定的分层阈值按院区保存为 thresholds.json，应用启动时读取
+
+示例：
+    python nec_thresholds.py cohort.csv --outcome surgery_72h --site site_a --plot dca.png
+"""
+
+import argparse
+import json
+import os
+
+import numpy as np
+import pandas as pd
+
+from nec_rules import DEFAULT_RISK_THRESHOLDS
+
+THRESHOLDS_FILE = 'thresholds.json'
+
+
+def load_thresholds(path=THRESHOLDS_FILE):
+    """读取 (中风险, 高风险) 阈值，文件不存在时返回默认值"""
+    if not os.path.exists(path):
+        return DEFAULT_RISK_THRESHOLDS
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+    return float(data['medium']), float(data['high'])
+
+
+def save_thresholds(path, medium, high, metrics=None):
+    """保存分层阈值及选择依据"""
+    if not 0 < medium < high < 1:
+        raise ValueError(f"阈值需满足 0 < 中风险({medium}) < 高风险({high}) < 1")
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump({'medium': medium, 'high': high, 'metrics': metrics or {}},
+                  f, ensure_ascii=False, indent=2)
+
+
+def sweep_thresholds(y_true, y_prob, thresholds=None):
+    """
+    一次性计算所有阈值（概率 ≥ 阈值判为阳性）下的分类指标和净获益
+
+    按概率降序排序后累计真/假阳性数，每个阈值的阳性数由二分查找得到。
+    thresholds 为 None 时使用队列中出现的全部概率值。
+    """
+    y_true = np.asarray(y_true, dtype=np.int64)
+    y_prob = np.asarray(y_prob, dtype=np.float64)
+    order = np.argsort(-y_prob, kind='mergesort')
+    neg_sorted = -y_prob[order]
+    y_sorted = y_true[order]
+    cum_tp = np.concatenate([[0], np.cumsum(y_sorted)])
+    cum_fp = np.concatenate([[0], np.cumsum(1 - y_sorted)])
+
+    if thresholds is None:
+        thresholds = np.unique(y_prob)
+    thresholds = np.asarray(thresholds, dtype=np.float64)
+    k = np.searchsorted(neg_sorted, -thresholds, side='right')
+
+    n = len(y_true)
+    n_pos = int(y_true.sum())
+    n_neg = n - n_pos
+    tp, fp = cum_tp[k], cum_fp[k]
+    fn, tn = n_pos - tp, n_neg - fp
+    with np.errstate(divide='ignore', invalid='ignore'):
+        odds = thresholds / (1 - thresholds)
+        return pd.DataFrame({
+            'threshold': thresholds,
+            'tp': tp, 'fp': fp, 'tn': tn, 'fn': fn,
+            'sensitivity': tp / n_pos,
+            'specificity': tn / n_neg,
+            'ppv': tp / (tp + fp),
+            'npv': tn / (tn + fn),
+            # 决策曲线：净获益 = TP/n - FP/n × pt/(1-pt)
+            'net_benefit': tp / n - fp / n * odds,
+            'net_benefit_treat_all': n_pos / n - n_neg / n * odds,
+        })
+
+
+def choose_tier_thresholds(sweep, min_sensitivity=0.9, min_specificity=0.9):
+    """
+    选择分层阈值
+
+    中风险阈值：灵敏度不低于 min_sensitivity 的最高阈值（低风险组漏诊少）；
+    高风险阈值：特异度不低于 min_specificity 的最低阈值（高风险组误报少）。
+    """
+    sens_ok = sweep[sweep['sensitivity'] >= min_sensitivity]
+    spec_ok = sweep[sweep['specificity'] >= min_specificity]
+    if sens_ok.empty or spec_ok.empty:
+        raise ValueError("队列中没有满足灵敏度/特异度要求的阈值")
+    medium = float(sens_ok['threshold'].max())
+    high = float(spec_ok['threshold'].min())
+    if medium >= high:
+        raise ValueError(f"中风险阈值 {medium:.3f} 不低于高风险阈值 {high:.3f}，请放宽要求")
+    return medium, high
+
+
+def plot_decision_curve(sweep, path):
+    """绘制决策曲线"""
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(8, 5))
+    ax.plot(sweep['threshold'], sweep['net_benefit'], label='Model', color='#1f77b4')
+    ax.plot(sweep['threshold'], sweep['net_benefit_treat_all'], label='Treat all', color='#999999')
+    ax.axhline(0, color='black', linewidth=1, label='Treat none')
+    ax.set_xlim(0, 1)
+    ax.set_ylim(-0.05, max(0.05, float(np.nanmax(sweep['net_benefit'])) * 1.1))
+    ax.set_xlabel('Threshold probability', fontsize=12)
+    ax.set_ylabel('Net benefit', fontsize=12)
+    ax.set_title('Decision Curve Analysis', fontsize=14, fontweight='bold')
+    ax.legend()
+    plt.tight_layout()
+    fig.savefig(path, dpi=150)
+    plt.close(fig)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="风险分层阈值优化与决策曲线分析")
+    parser.add_argument('cohort', help="带结局的队列CSV")
+    parser.add_argument('--outcome', default='surgery_72h', help="结局列名（0/1）")
+    parser.add_argument('--prob-col', default=None, help="已有预测概率列，缺省时用院区模型批量评分")
+    parser.add_argument('--site', default='default', help="院区ID，阈值保存到该院区的模型包目录")
+    parser.add_argument('--min-sensitivity', type=float, default=0.9)
+    parser.add_argument('--min-specificity', type=float, default=0.9)
+    parser.add_argument('--plot', default=None, help="决策曲线输出图片路径")
+    parser.add_argument('--dry-run', action='store_true', help="只输出结果，不保存阈值")
+    args = parser.parse_args()
+
+    from nec_model_manager import ModelManager
+
+    manager = ModelManager()
+    try:
+        site_dir = manager.site_dir(args.site)
+    except KeyError as e:
+        parser.error(e.args[0])
+    cohort = pd.read_csv(args.cohort).dropna(subset=[args.outcome])
+    if args.prob_col:
+        probs = cohort[args.prob_col].to_numpy()
+    else:
+        probs = manager.predict(args.site, cohort)
+
+    sweep = sweep_thresholds(cohort[args.outcome], probs)
+    medium, high = choose_tier_thresholds(sweep, args.min_sensitivity, args.min_specificity)
+
+    grid = sweep_thresholds(cohort[args.outcome], probs, [medium, high, *DEFAULT_RISK_THRESHOLDS])
+    grid.insert(0, 'label', ['中风险(新)', '高风险(新)', '中风险(原)', '高风险(原)'])
+    print(grid.round(3).to_string(index=False))
+
+    if args.plot:
+        plot_decision_curve(sweep_thresholds(cohort[args.outcome], probs, np.linspace(0.01, 0.99, 99)),
+                            args.plot)
+        print(f"决策曲线已保存: {args.plot}")
+
+    if not args.dry_run:
+        path = os.path.join(site_dir, THRESHOLDS_FILE)
+        metrics = json.loads(grid.iloc[:2].drop(columns='label').to_json(orient='records'))
+        save_thresholds(path, medium, high, {'n': len(cohort), 'at_thresholds': metrics})
+        print(f"分层阈值已保存: {path} (中风险 ≥ {medium:.3f}，高风险 ≥ {high:.3f})")
+
+
+if __name__ == "__main__":
+    main()